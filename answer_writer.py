@@ -0,0 +1,148 @@
+import os
+import time
+import queue
+import hashlib
+import logging
+import threading
+from typing import Callable, List, Optional
+from dotenv import load_dotenv
+from embedding_cache import normalize_text
+from metrics import timed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GENERATED_WRITE_BATCH_SIZE = int(os.getenv('GENERATED_WRITE_BATCH_SIZE', '32'))
+GENERATED_WRITE_INTERVAL = float(os.getenv('GENERATED_WRITE_INTERVAL', '1.0'))
+# Новый ответ с такой близостью к уже сохраненному сгенерированному сливается с ним (больше 1 - отключено)
+GENERATED_DEDUP_RELEVANCE = float(os.getenv('GENERATED_DEDUP_RELEVANCE', '0.95'))
+
+_STOP = object()
+
+def generated_id(question: str) -> str:
+    # Один и тот же (после нормализации) вопрос всегда получает один id - повтор перезапишет запись
+    return f"gen-{hashlib.sha1(normalize_text(question).encode('utf-8')).hexdigest()}"
+
+def merge_metadata(metadata: dict, duplicates: int = 1) -> dict:
+    # Дубликат не добавляет новую запись и не меняет ответ и источники существующей: только счетчик слияний
+    return {**metadata, "merged_count": metadata.get("merged_count", 0) + duplicates}
+
+# (вопрос, ответ, источники) - то, что действительно записано в базу
+SavedCallback = Callable[[str, str, str], None]
+
+class GeneratedAnswerWriter:
+    def __init__(self, collection, batch_size: int = GENERATED_WRITE_BATCH_SIZE,
+                 flush_interval: float = GENERATED_WRITE_INTERVAL, dedup_relevance: float = GENERATED_DEDUP_RELEVANCE,
+                 mirror=None, on_saved: Optional[SavedCallback] = None):
+        self.collection = collection
+        # Индекс поиска, который должен видеть те же изменения (см. vector_index.py)
+        self.mirror = mirror
+        # Вызывается из потока записи для каждого сохраненного вопроса
+        self.on_saved = on_saved
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dedup_relevance = dedup_relevance
+        self.queue: queue.Queue = queue.Queue()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="generated-answer-writer", daemon=True)
+            self.thread.start()
+
+    def submit(self, question: str, answer: str, reference: str, embedding: List[float]) -> None:
+        self.queue.put((question, answer, reference, embedding))
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.thread = None
+
+    def run(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            # Собираем пачку, пока не наберется batch_size или не истечет flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self.write(batch)
+            if stopping:
+                return
+
+    def merge_duplicates(self, entries: dict) -> set:
+        # Возвращает id перефразировок, которые не сохраняются: их вопрос и так находится
+        # по близкой сохраненной записи, а ответ, написанный заново, отбрасывается вместе с его источниками
+        if self.dedup_relevance > 1:
+            return set()
+        entry_ids = list(entries)
+        results = self.collection.query(
+            query_embeddings=[entries[entry_id][3] for entry_id in entry_ids],
+            n_results=1,
+            where={"is_generated": True},
+            include=["metadatas", "distances"]
+        )
+
+        duplicates = set()
+        updates = {}
+        for entry_id, found_ids, metadatas, distances in zip(
+            entry_ids, results['ids'], results['metadatas'], results['distances']
+        ):
+            # Тот же вопрос перезаписывается через upsert, а не сливается
+            if not found_ids or found_ids[0] == entry_id or 1 - distances[0] < self.dedup_relevance:
+                continue
+            duplicates.add(entry_id)
+            # Псевдонимы из старых версий (alias_of) удаляет manage_db.py --dedup-generated, счетчик им не нужен
+            if not metadatas[0].get("alias_of"):
+                updates[found_ids[0]] = merge_metadata(updates.get(found_ids[0], metadatas[0]))
+
+        if updates:
+            self.collection.update(ids=list(updates), metadatas=list(updates.values()))
+            if self.mirror is not None:
+                self.mirror.update(ids=list(updates), metadatas=list(updates.values()))
+        return duplicates
+
+    def write(self, batch: list) -> None:
+        # Внутри пачки оставляем последний ответ на каждый вопрос
+        entries = {generated_id(question): (question, answer, reference, embedding)
+                   for question, answer, reference, embedding in batch}
+        try:
+            with timed("save", "chroma", self.collection.name):
+                self.save(entries)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении ответа: {str(e)}")
+
+    def save(self, entries: dict) -> None:
+        duplicates = self.merge_duplicates(entries)
+        entries = {entry_id: entry for entry_id, entry in entries.items() if entry_id not in duplicates}
+        if not entries:
+            return
+        metadatas = [
+            {"answer": answer, "reference": reference, "is_generated": True, "created_at": int(time.time())}
+            for _, answer, reference, _ in entries.values()
+        ]
+        records = {
+            "ids": list(entries),
+            "embeddings": [embedding for _, _, _, embedding in entries.values()],
+            "documents": [question for question, _, _, _ in entries.values()],
+            "metadatas": metadatas
+        }
+        self.collection.upsert(**records)
+        if self.mirror is not None:
+            self.mirror.upsert(**records)
+        if self.on_saved is not None:
+            for question, metadata in zip(records["documents"], metadatas):
+                self.on_saved(question, metadata["answer"], metadata["reference"])
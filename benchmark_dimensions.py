@@ -0,0 +1,92 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import chromadb
+import numpy as np
+from typing import List
+from kb_sync import COLLECTION_NAME, chunks, iter_pages
+from vector_index import normalize_rows
+from vector_store import CHROMA_HOST, CHROMA_PATH, CHROMA_PORT, get_chroma_client, is_embedded
+
+# Сравнение поиска по укороченным векторам с полной размерностью на векторах текущей базы.
+# Запросом служит каждый выбранный вопрос базы: сравниваются его ближайшие соседи (без него самого)
+
+def load_matrix() -> np.ndarray:
+    collection = get_chroma_client().get_collection(COLLECTION_NAME)
+    pages = [np.asarray(page['embeddings'], dtype=np.float32)
+             for page in iter_pages(collection, include=["embeddings"])]
+    if not pages:
+        raise ValueError("Коллекция пуста")
+    return normalize_rows(np.vstack(pages))
+
+def exact_neighbors(matrix: np.ndarray, rows: np.ndarray, k: int) -> List[set]:
+    scores = matrix[rows] @ matrix.T
+    scores[np.arange(len(rows)), rows] = -np.inf
+    return [set(np.argpartition(-row, k - 1)[:k]) for row in scores]
+
+def recall(expected: List[set], found: List[set]) -> float:
+    return float(np.mean([len(e & f) / len(e) for e, f in zip(expected, found)]))
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+def hnsw_run(matrix: np.ndarray, rows: np.ndarray, k: int) -> dict:
+    # Временная коллекция Chroma с теми же векторами: время запроса и точность HNSW
+    workdir = tempfile.mkdtemp(prefix="kb-dimensions-")
+    try:
+        client = chromadb.PersistentClient(path=workdir)
+        collection = client.create_collection(name="benchmark", metadata={"hnsw:space": "cosine"})
+        ids = [str(i) for i in range(len(matrix))]
+        for batch in chunks(list(range(len(matrix))), 1000):
+            collection.add(ids=[ids[i] for i in batch], embeddings=matrix[batch])
+
+        found = []
+        latencies = []
+        for row in rows:
+            started = time.perf_counter()
+            result = collection.query(query_embeddings=[matrix[row]], n_results=k + 1, include=[])
+            latencies.append(time.perf_counter() - started)
+            found.append(set([int(i) for i in result['ids'][0] if int(i) != row][:k]))
+        return {"found": found, "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+                "p95_ms": float(np.percentile(latencies, 95)) * 1000, "disk_bytes": dir_size(workdir)}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall vs latency and memory for truncated embedding dimensions')
+    parser.add_argument('--dims', default='256,512,1024', help='Comma-separated dimensions to compare with the full size')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--no-hnsw', action='store_true', help='Only brute-force search, without building Chroma indexes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    source = CHROMA_PATH if is_embedded() else f"Chroma server {CHROMA_HOST}:{CHROMA_PORT}"
+    print(f"Loading vectors from {source}...")
+    full = load_matrix()
+    rows = np.random.default_rng(args.seed).choice(len(full), size=min(args.queries, len(full)), replace=False)
+    expected = exact_neighbors(full, rows, args.k)
+    dims = sorted({int(d) for d in args.dims.split(",") if 0 < int(d) < full.shape[1]}) + [full.shape[1]]
+    print(f"{len(full)} vectors of {full.shape[1]} dims, {len(rows)} queries, recall@{args.k} against full-size exact search")
+
+    header = f"{'dims':>6}{'matrix MB':>11}{'exact recall':>14}{'exact ms':>10}"
+    if not args.no_hnsw:
+        header += f"{'hnsw recall':>13}{'hnsw p50 ms':>13}{'hnsw p95 ms':>13}{'chroma MB':>11}"
+    print(header)
+    for d in dims:
+        # Так же, как API с параметром dimensions: обрезка и повторная нормализация
+        matrix = normalize_rows(full[:, :d]) if d < full.shape[1] else full
+        started = time.perf_counter()
+        found = exact_neighbors(matrix, rows, args.k)
+        exact_ms = (time.perf_counter() - started) / len(rows) * 1000
+        line = f"{d:>6}{matrix.nbytes / 1024 / 1024:>11.2f}{recall(expected, found):>14.3f}{exact_ms:>10.3f}"
+        if not args.no_hnsw:
+            hnsw = hnsw_run(matrix, rows, args.k)
+            line += (f"{recall(expected, hnsw['found']):>13.3f}{hnsw['p50_ms']:>13.3f}{hnsw['p95_ms']:>13.3f}"
+                     f"{hnsw['disk_bytes'] / 1024 / 1024:>11.2f}")
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import io
+import os
+import math
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import importlib
+import contextlib
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from fake_providers import FAKE_ANSWER_WORDS, Latency, fake_embeddings, start_process
+
+# Нагрузочный тест telegram_chat_hybrid.handle_message без OpenAI и Telegram:
+# провайдеры заменены локальными заглушками, обновления Telegram - синтетическими объектами
+
+QUESTION_WORDS = 20
+PATHS = ("direct", "generated", "no_context")
+
+class FakeSentMessage:
+    def __init__(self, chat: 'FakeChat', text: str):
+        self.chat = chat
+        self.text = text
+
+    async def edit_text(self, text: str) -> 'FakeSentMessage':
+        await self.chat.call(text)
+        self.text = text
+        return self
+
+class FakeChat:
+    def __init__(self, chat_id: int, telegram_latency: float):
+        self.id = chat_id
+        self.telegram_latency = telegram_latency
+        self.texts: List[str] = []
+        self.first_reply_at: Optional[float] = None
+
+    async def call(self, text: Optional[str] = None) -> None:
+        await asyncio.sleep(self.telegram_latency)
+        if text is not None:
+            self.texts.append(text)
+            if self.first_reply_at is None:
+                self.first_reply_at = time.perf_counter()
+
+    async def send_action(self, action: str) -> None:
+        await self.call()
+
+class FakeMessage:
+    def __init__(self, chat: FakeChat, text: str):
+        self.chat = chat
+        self.text = text
+
+    async def reply_text(self, text: str) -> FakeSentMessage:
+        await self.chat.call(text)
+        return FakeSentMessage(self.chat, text)
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.first_name = f"User {user_id}"
+
+class FakeUpdate:
+    def __init__(self, chat: FakeChat, user: FakeUser, text: str):
+        self.message = FakeMessage(chat, text)
+        self.effective_chat = chat
+        self.effective_user = user
+
+def make_dataset(path: str, size: int, rng: random.Random) -> List[List[str]]:
+    vocabulary = [f"term{i}" for i in range(size * 4)]
+    questions = [rng.sample(vocabulary, QUESTION_WORDS) for _ in range(size)]
+    pd.DataFrame({
+        'Вопрос': [" ".join(words) for words in questions],
+        'Ответ': [f"Ответ из базы знаний номер {i}. " * 20 for i in range(size)],
+        'Ссылка': [f"https://example.org/kb/{i}" for i in range(size)]
+    }).to_csv(path, index=False)
+    return questions
+
+def make_query(path: str, questions: List[List[str]], n: int, rng: random.Random) -> str:
+    # Близость к вопросам базы задается составом слов, так как заглушка строит эмбеддинг как мешок слов
+    words = list(rng.choice(questions))
+    if path == "direct":
+        # Те же слова в другом порядке: близость 1.0, но мимо индекса точных совпадений
+        return " ".join(reversed(words))
+    if path == "generated":
+        # Одно слово заменено: близость ~0.95 - выше MIN_RELEVANCE, но ниже DIRECT_ANSWER_RELEVANCE
+        words[rng.randrange(len(words))] = f"nonce{n}"
+        return " ".join(words)
+    return " ".join(f"offtopic{n}x{i}" for i in range(QUESTION_WORDS))
+
+def classify(texts: List[str]) -> str:
+    if not texts:
+        return "error"
+    final = texts[-1]
+    if final.startswith(("📖", "🚀")):
+        return "direct"
+    if final.startswith("Извините, произошла ошибка"):
+        return "error"
+    if final.startswith("Извините"):
+        return "no_context"
+    return "generated"
+
+def percentile(values: List[float], p: float) -> float:
+    # Метод ближайшего ранга
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+async def simulate_user(bot, user_id: int, messages: int, mix: Dict[str, float], questions: List[List[str]],
+                        telegram_latency: float, think_time: float, rng: random.Random,
+                        results: List[Tuple[str, str, float, float]]) -> None:
+    user = FakeUser(user_id)
+    for i in range(messages):
+        path = rng.choices(list(mix), weights=list(mix.values()))[0]
+        chat = FakeChat(user_id, telegram_latency)
+        update = FakeUpdate(chat, user, make_query(path, questions, user_id * messages + i, rng))
+        started = time.perf_counter()
+        try:
+            await bot.handle_message(update, None)
+        except Exception as e:
+            chat.texts.append(f"Извините, произошла ошибка: {str(e)}")
+        finished = time.perf_counter()
+        first_reply = (chat.first_reply_at or finished) - started
+        results.append((path, classify(chat.texts), finished - started, first_reply))
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, think_time * 2))
+
+async def run(bot, args, mix: Dict[str, float], questions: List[List[str]]) -> Tuple[List[Tuple[str, str, float, float]], float]:
+    results: List[Tuple[str, str, float, float]] = []
+    rng = random.Random(args.seed)
+    if not args.cold:
+        # Как при запуске бота: индекс и соединения прогреваются до первого сообщения
+        await bot.warm_up_bot()
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        simulate_user(bot, user_id, args.messages, mix, questions, args.telegram_latency, args.think_time,
+                      random.Random(rng.random()), results)
+        for user_id in range(1, args.users + 1)
+    ])
+    elapsed = time.perf_counter() - started
+    await bot.get_openai_client().close()
+    return results, elapsed
+
+def report(results: List[Tuple[str, str, float, float]], elapsed: float) -> Dict[str, float]:
+    print(f"\nRequests: {len(results)} in {elapsed:.2f}s, throughput {len(results) / elapsed:.1f} req/s")
+    mismatches = sum(1 for expected, actual, _, _ in results if expected != actual)
+    if mismatches:
+        print(f"Warning: {mismatches} requests took a different path than planned (outcome is reported below)")
+
+    print(f"{'path':<12}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'first p50':>11}{'first p95':>11}")
+    p95 = {}
+    for path in PATHS + ("error",):
+        latencies = [total for _, actual, total, _ in results if actual == path]
+        if not latencies:
+            continue
+        first = [first for _, actual, _, first in results if actual == path]
+        p95[path] = percentile(latencies, 95)
+        print(f"{path:<12}{len(latencies):>7}"
+              f"{percentile(latencies, 50):>9.3f}{p95[path]:>9.3f}{percentile(latencies, 99):>9.3f}{max(latencies):>9.3f}"
+              f"{percentile(first, 50):>11.3f}{percentile(first, 95):>11.3f}")
+    return p95
+
+def parse_mix(value: str) -> Dict[str, float]:
+    weights = [float(part) for part in value.split(":")]
+    if len(weights) != len(PATHS):
+        raise argparse.ArgumentTypeError("mix must be direct:generated:no_context, e.g. 6:3:1")
+    return {path: weight for path, weight in zip(PATHS, weights) if weight > 0}
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Offline load benchmark for telegram_chat_hybrid')
+    parser.add_argument('--users', type=int, default=20, help='Concurrent simulated users (one chat each)')
+    parser.add_argument('--messages', type=int, default=10, help='Messages sent by each user, one after another')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix("6:3:1"),
+                        help='Share of direct:generated:no_context questions')
+    parser.add_argument('--kb-size', type=int, default=500, help='Questions in the synthetic knowledge base')
+    parser.add_argument('--embedding-latency', type=float, default=Latency.embedding)
+    parser.add_argument('--completion-latency', type=float, default=Latency.completion)
+    parser.add_argument('--token-latency', type=float, default=Latency.token)
+    parser.add_argument('--answer-words', type=int, default=FAKE_ANSWER_WORDS, help='Length of generated answers')
+    parser.add_argument('--telegram-latency', type=float, default=0.03, help='Latency of each Telegram API call')
+    parser.add_argument('--think-time', type=float, default=0.0, help='Mean pause between messages of one user')
+    parser.add_argument('--backend', choices=['chroma', 'numpy'], default='chroma', help='RETRIEVAL_BACKEND to test')
+    parser.add_argument('--cold', action='store_true', help='Skip the bot warm-up to measure cold-start latency')
+    parser.add_argument('--stream', choices=['true', 'false'], default=None, help='Override STREAM_RESPONSES')
+    parser.add_argument('--fail-p95', type=float, default=None,
+                        help='Exit with status 1 if p95 latency of any path exceeds this many seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help='Show the bot output')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    latency = Latency(args.embedding_latency, args.completion_latency, args.token_latency)
+    server, server_url = start_process(latency, args.answer_words)
+    workdir = tempfile.mkdtemp(prefix="kb-benchmark-")
+
+    # Бот читает настройки при импорте, поэтому окружение готовим заранее.
+    # База всегда локальная во временном каталоге, даже если в .env указан сервер Chroma
+    os.environ.update({
+        "CHROMA_MODE": "embedded",
+        "CHROMA_PATH": "./chroma_db",
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": f"{server_url}/v1",
+        "TELEGRAM_TOKEN": "fake",
+        "EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite"),
+        "MIN_RELEVANCE": "0.9",
+        "DIRECT_ANSWER_RELEVANCE": "0.98",
+        "RETRIEVAL_BACKEND": args.backend,
+        "NUMPY_INDEX_PATH": os.path.join(workdir, "numpy_index")
+    })
+    if args.stream is not None:
+        os.environ["STREAM_RESPONSES"] = args.stream
+    os.chdir(workdir)
+
+    print(f"Building a synthetic knowledge base of {args.kb_size} questions in {workdir}...")
+    questions = make_dataset("dataset.csv", args.kb_size, random.Random(args.seed))
+    import kb_sync
+    import vector_index
+    from vector_store import get_chroma_client
+    client = get_chroma_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        kb_sync.rebuild(client, kb_sync.read_dataset("dataset.csv"), fake_embeddings, batch_size=kb_sync.SYNC_BATCH_SIZE)
+    if args.backend == "numpy":
+        vector_index.export_numpy_index(client.get_collection(kb_sync.COLLECTION_NAME))
+
+    bot = importlib.import_module("telegram_chat_hybrid")
+    config = bot.get_config()
+    # Как в main() бота: словари tiktoken скачиваются заранее, без сети бюджет токенов считается по оценке
+    import tokenizer
+    if not tokenizer.preload_encodings([config.embedding_model, config.generation_model]):
+        print("tiktoken vocabularies are not available (no network and no TIKTOKEN_CACHE_DIR): "
+              "token budgets use the character estimate")
+    bot.get_answer_writer().start()
+    print(f"Running {args.users} users x {args.messages} messages "
+          f"(backend: {args.backend}, concurrent generations: {config.max_concurrent_generations}, "
+          f"streaming: {config.stream_responses}, warm-up: {not args.cold})...")
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            results, elapsed = asyncio.run(run(bot, args, args.mix, questions))
+    finally:
+        bot.get_answer_writer().stop()
+        server.terminate()
+
+    p95 = report(results, elapsed)
+    if args.fail_p95 is not None and any(value > args.fail_p95 for value in p95.values()):
+        print(f"p95 latency exceeds {args.fail_p95}s")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
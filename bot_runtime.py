@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Awaitable, Callable, List, Tuple
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from telegram.ext import Application
+from kb_sync import COLLECTION_NAME, collection_dimension
+from vector_store import database_exists, get_chroma_client
+
+load_dotenv()
+
+# Публичный https-адрес, на который Telegram присылает обновления (пусто - polling)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+# Где слушает встроенный HTTP-сервер; снаружи к нему ведет reverse proxy с TLS
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Telegram передает его в заголовке X-Telegram-Bot-Api-Secret-Token, запросы без него отклоняются
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Сколько соединений одновременно Telegram открывает для доставки обновлений
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# (название шага, корутина без аргументов)
+WarmupStep = Tuple[str, Callable[[], Awaitable[object]]]
+
+class StartupError(Exception):
+    # Ошибка настройки, найденная при прогреве: с ней бот не может отвечать, запуск прерывается
+    pass
+
+_collection = None
+_lock = threading.Lock()
+
+def get_collection():
+    # База открывается при первом обращении, а не при импорте модуля бота
+    global _collection
+    with _lock:
+        if _collection is None:
+            if not database_exists():
+                raise FileNotFoundError("База данных не найдена. Сначала запустите load_dataset.py")
+            _collection = get_chroma_client().get_collection(COLLECTION_NAME)
+        return _collection
+
+def warm_collection(collection) -> None:
+    # Первый запрос загружает HNSW-индекс с диска в память; второй - путь с фильтром по метаданным
+    dimension = collection_dimension(collection)
+    if not dimension:
+        return
+    probe = [1.0] + [0.0] * (dimension - 1)
+    collection.query(query_embeddings=[probe], n_results=1, include=[])
+    collection.query(query_embeddings=[probe], n_results=1, where={"is_generated": False}, include=[])
+
+async def warm_up(steps: List[WarmupStep], report: Callable[[str], None] = print,
+                  warn: Callable[[str], None] = print) -> None:
+    # Холодный старт оплачивается до приема сообщений, а не первым пользователем.
+    # Неудачный шаг не мешает запуску (кроме StartupError): настоящий запрос сообщит об ошибке как обычно
+    async def run(name: str, step: Callable[[], Awaitable[object]]) -> None:
+        started = time.perf_counter()
+        try:
+            await step()
+        except StartupError:
+            raise
+        except Exception as e:
+            warn(f"Прогрев: {name} - ошибка: {str(e)}")
+            return
+        report(f"Прогрев: {name} - {time.perf_counter() - started:.2f} с")
+
+    await asyncio.gather(*(run(name, step) for name, step in steps))
+
+def run_bot(application: Application, started_message: str = "Бот запущен",
+            report: Callable[[str], None] = print, error: Callable[[str], None] = print) -> None:
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        error("Для режима webhook задайте WEBHOOK_SECRET (1-256 символов A-Z, a-z, 0-9, _ и -)")
+        return
+    try:
+        if not WEBHOOK_URL:
+            report(started_message)
+            application.run_polling()
+            return
+
+        report(f"{started_message}: webhook {WEBHOOK_URL}, слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}")
+        # При остановке сервер перестает принимать обновления, уже полученные дообрабатываются,
+        # затем вызываются post_stop и post_shutdown
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urlparse(WEBHOOK_URL).path.lstrip('/'),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    except StartupError as e:
+        error(f"Бот остановлен: {str(e)}")
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from embedding_cache import normalize_text
+from vector_index import normalize_rows
+
+load_dotenv()
+
+# Вес релевантности против непохожести на уже выбранные фрагменты (1 - только релевантность)
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+# Фрагмент, вопрос которого почти совпадает с уже выбранным, в промпт не попадает
+DUPLICATE_SIMILARITY = float(os.getenv('CONTEXT_DUPLICATE_SIMILARITY', '0.97'))
+
+def mmr_order(relevances: np.ndarray, vectors: np.ndarray, mmr_lambda: float,
+              duplicate_similarity: float) -> Tuple[List[int], int]:
+    similarity = vectors @ vectors.T
+    remaining = list(range(len(relevances)))
+    selected: List[int] = []
+    duplicates = 0
+    while remaining:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = mmr_lambda * relevances[remaining] - (1 - mmr_lambda) * redundancy
+        best = remaining.pop(int(np.argmax(scores)))
+        if selected and similarity[best, selected].max() >= duplicate_similarity:
+            duplicates += 1
+            continue
+        selected.append(best)
+    return selected, duplicates
+
+def drop_repeated_answers(items: List[dict]) -> Tuple[List[dict], int]:
+    # Одинаковый ответ под разными вопросами передается один раз
+    kept: List[dict] = []
+    seen_answers = set()
+    for item in items:
+        answer_key = normalize_text(item['answer'])
+        if answer_key not in seen_answers:
+            seen_answers.add(answer_key)
+            kept.append(item)
+    return kept, len(items) - len(kept)
+
+def merge_by_reference(items: List[dict]) -> Tuple[List[dict], int]:
+    # Фрагменты с одним URL объединяются в один: URL и заголовки передаются один раз.
+    # Вызывается для фрагментов, уже прошедших бюджет токенов, - объединенный блок не длиннее своих частей
+    merged: List[dict] = []
+    by_reference: Dict[str, dict] = {}
+    count = 0
+    for item in items:
+        reference = item['reference'].strip()
+        target = by_reference.get(reference) if reference else None
+        if target is None:
+            merged.append(dict(item))
+            if reference:
+                by_reference[reference] = merged[-1]
+            continue
+        target['question'] += "\n" + item['question']
+        target['answer'] += "\n\n" + item['answer']
+        target['relevance'] = max(target['relevance'], item['relevance'])
+        count += 1
+    return merged, count
+
+def select_context(items: List[dict], mmr_lambda: float = MMR_LAMBDA,
+                   duplicate_similarity: float = DUPLICATE_SIMILARITY) -> Tuple[List[dict], dict]:
+    # Порядок результата - порядок добавления в промпт: первым идет самый релевантный фрагмент
+    if not items:
+        return [], {"duplicates": 0}
+    relevances = np.array([item['relevance'] for item in items], dtype=np.float32)
+    vectors = normalize_rows(np.asarray([item['embedding'] for item in items], dtype=np.float32))
+    order, duplicates = mmr_order(relevances, vectors, mmr_lambda, duplicate_similarity)
+    selected, repeated = drop_repeated_answers([items[i] for i in order])
+    return selected, {"duplicates": duplicates + repeated}
@@ -0,0 +1,154 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional, List, Dict
+
+from dotenv import load_dotenv
+from metrics import EMBEDDING_CACHE_LOOKUPS
+
+load_dotenv()
+
+CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', './embedding_cache.sqlite')
+CACHE_MEMORY_SIZE = int(os.getenv('EMBEDDING_CACHE_MEMORY_SIZE', '2000'))
+CACHE_DISK_SIZE = int(os.getenv('EMBEDDING_CACHE_DISK_SIZE', '100000'))
+CACHE_TTL = int(os.getenv('EMBEDDING_CACHE_TTL', str(30 * 24 * 3600)))
+
+# Как часто (в количестве записей) чистить устаревшие записи на диске
+EVICTION_INTERVAL = 500
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+def model_with_dimensions(model: str, dimensions: int = 0) -> str:
+    # Векторы одной модели разной размерности не должны попадать в кэш под одним ключом
+    return f"{model}@{dimensions}" if dimensions else model
+
+def make_key(provider: str, model: str, text: str) -> str:
+    raw = f"{provider}\x00{model}\x00{normalize_text(text)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str] = CACHE_PATH, memory_size: int = CACHE_MEMORY_SIZE,
+                 disk_size: int = CACHE_DISK_SIZE, ttl: int = CACHE_TTL):
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.puts_since_eviction = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)")
+            self.db.commit()
+
+    def is_expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def get(self, provider: str, model: str, text: str) -> Optional[List[float]]:
+        key = make_key(provider, model, text)
+        with self.lock:
+            item = self.memory.get(key)
+            if item is not None:
+                vector, created_at = item
+                if not self.is_expired(created_at):
+                    self.memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    EMBEDDING_CACHE_LOOKUPS.labels("memory_hit", provider, model).inc()
+                    return list(vector)
+                del self.memory[key]
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT vector, created_at FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self.is_expired(row[1]):
+                    vector = array('f')
+                    vector.frombytes(row[0])
+                    self.db.execute("UPDATE embeddings SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                    self.db.commit()
+                    self.remember(key, vector, row[1])
+                    self.hits += 1
+                    EMBEDDING_CACHE_LOOKUPS.labels("disk_hit", provider, model).inc()
+                    return list(vector)
+
+            self.misses += 1
+            EMBEDDING_CACHE_LOOKUPS.labels("miss", provider, model).inc()
+            return None
+
+    def put(self, provider: str, model: str, text: str, embedding: List[float]) -> None:
+        key = make_key(provider, model, text)
+        vector = array('f', embedding)
+        now = time.time()
+        with self.lock:
+            self.remember(key, vector, now)
+            if self.db is None:
+                return
+            self.db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, vector.tobytes(), now, now)
+            )
+            self.db.commit()
+            self.puts_since_eviction += 1
+            if self.puts_since_eviction >= EVICTION_INTERVAL:
+                self.evict()
+
+    def remember(self, key: str, vector: array, created_at: float) -> None:
+        if self.memory_size <= 0:
+            return
+        self.memory[key] = (vector, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def evict(self) -> None:
+        self.puts_since_eviction = 0
+        if self.ttl > 0:
+            self.db.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - self.ttl,))
+        # Сверх лимита удаляем записи, к которым дольше всего не обращались
+        self.db.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_size,)
+        )
+        self.db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            disk_entries = 0
+            if self.db is not None:
+                disk_entries = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.hits - self.memory_hits,
+                "misses": self.misses,
+                "memory_entries": len(self.memory),
+                "disk_entries": disk_entries
+            }
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
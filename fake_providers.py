@@ -0,0 +1,262 @@
+import re
+import json
+import time
+import socket
+import hashlib
+import argparse
+import multiprocessing
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List, Optional, Tuple
+
+# Локальные заглушки OpenAI, Ollama и Yandex Foundation Models для нагрузочных тестов:
+# те же форматы запросов и ответов, настраиваемая задержка, никаких платных вызовов
+
+FAKE_EMBEDDING_DIM = 512
+FAKE_ANSWER_WORDS = 100
+
+def fake_embedding(text: str, dim: int = FAKE_EMBEDDING_DIM) -> List[float]:
+    # Мешок слов: каждое слово - своя координата, поэтому близость текстов предсказуема
+    vector = [0.0] * dim
+    for word in re.findall(r'\w+', text.lower()):
+        vector[int(hashlib.sha1(word.encode('utf-8')).hexdigest(), 16) % dim] += 1.0
+    norm = sum(value * value for value in vector) ** 0.5
+    if not norm:
+        vector[0] = norm = 1.0
+    return [value / norm for value in vector]
+
+def fake_embeddings(texts: List[str]) -> List[List[float]]:
+    return [fake_embedding(text) for text in texts]
+
+@dataclass
+class Latency:
+    embedding: float = 0.05
+    completion: float = 0.5
+    # Пауза между фрагментами потокового ответа
+    token: float = 0.02
+
+def fake_answer(words: int) -> str:
+    sentence = "Синтетический ответ заглушки на основе найденного контекста."
+    return " ".join([sentence] * max(1, words // len(sentence.split())))
+
+def prompt_urls(prompt: str) -> str:
+    return "\n".join(dict.fromkeys(re.findall(r'https?://\S+', prompt)))
+
+def pieces(text: str) -> Iterator[str]:
+    yield from re.findall(r'\S+\s*', text)
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def latency(self) -> Latency:
+        return self.server.latency
+
+    def answer_words(self, max_tokens: int) -> int:
+        return min(max_tokens, self.server.answer_words)
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, chunks: Iterator[str], content_type: str) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            data = chunk.encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def stream_text(self, text: str) -> Iterator[str]:
+        for piece in pieces(text):
+            time.sleep(self.latency.token)
+            yield piece
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self.send_json({"models": [{"name": "fake"}]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        routes = {
+            '/v1/embeddings': self.openai_embeddings,
+            '/v1/chat/completions': self.openai_chat,
+            '/api/embeddings': self.ollama_embeddings,
+            '/api/embed': self.ollama_embed,
+            '/api/generate': self.ollama_generate,
+            '/foundationModels/v1/textEmbedding': self.yandex_embedding,
+            '/foundationModels/v1/completion': self.yandex_completion,
+            '/iam/v1/tokens': self.yandex_iam
+        }
+        route = routes.get(self.path)
+        if route is None:
+            self.send_json({"error": "not found"}, 404)
+            return
+        route(self.read_json())
+
+    def openai_embeddings(self, request: dict) -> None:
+        texts = request['input'] if isinstance(request['input'], list) else [request['input']]
+        time.sleep(self.latency.embedding)
+        self.send_json({
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": embedding}
+                     for i, embedding in enumerate(fake_embeddings(texts))],
+            "model": request.get('model', 'fake'),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        })
+
+    def openai_chat(self, request: dict) -> None:
+        prompt = "\n".join(message['content'] for message in request['messages'])
+        answer = fake_answer(self.answer_words(request.get('max_tokens') or FAKE_ANSWER_WORDS))
+        if request.get('response_format', {}).get('type') == 'json_object':
+            content = json.dumps({"answer": answer, "reference": prompt_urls(prompt)}, ensure_ascii=False)
+        else:
+            content = answer
+        time.sleep(self.latency.completion)
+
+        if not request.get('stream'):
+            self.send_json({
+                "id": "fake", "object": "chat.completion", "created": int(time.time()),
+                "model": request['model'],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+            })
+            return
+
+        def events() -> Iterator[str]:
+            for piece in self.stream_text(content):
+                chunk = {
+                    "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": request['model'],
+                    "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        self.send_stream(events(), 'text/event-stream')
+
+    def ollama_embeddings(self, request: dict) -> None:
+        time.sleep(self.latency.embedding)
+        self.send_json({"embedding": fake_embedding(request['prompt'])})
+
+    def ollama_embed(self, request: dict) -> None:
+        texts = request['input'] if isinstance(request['input'], list) else [request['input']]
+        time.sleep(self.latency.embedding)
+        self.send_json({"model": request.get('model', 'fake'), "embeddings": fake_embeddings(texts)})
+
+    def ollama_generate(self, request: dict) -> None:
+        text = f"{fake_answer(self.server.answer_words)}\nИсточники:\n{prompt_urls(request['prompt'])}"
+        time.sleep(self.latency.completion)
+        if not request.get('stream', True):
+            self.send_json({"model": request['model'], "response": text, "done": True})
+            return
+
+        def lines() -> Iterator[str]:
+            for piece in self.stream_text(text):
+                yield json.dumps({"model": request['model'], "response": piece, "done": False}, ensure_ascii=False) + "\n"
+            yield json.dumps({"model": request['model'], "response": "", "done": True}) + "\n"
+        self.send_stream(lines(), 'application/x-ndjson')
+
+    def yandex_embedding(self, request: dict) -> None:
+        time.sleep(self.latency.embedding)
+        self.send_json({"embedding": fake_embedding(request['text']), "numTokens": "0", "modelVersion": "fake"})
+
+    def yandex_completion(self, request: dict) -> None:
+        text = fake_answer(self.answer_words(int(request['completionOptions'].get('maxTokens', FAKE_ANSWER_WORDS))))
+        time.sleep(self.latency.completion)
+
+        def result(text: str, status: str) -> dict:
+            return {"result": {
+                "alternatives": [{"message": {"role": "assistant", "text": text}, "status": status}],
+                "usage": {"inputTextTokens": "0", "completionTokens": "0", "totalTokens": "0"},
+                "modelVersion": "fake"
+            }}
+
+        if not request['completionOptions'].get('stream'):
+            self.send_json(result(text, "ALTERNATIVE_STATUS_FINAL"))
+            return
+
+        def lines() -> Iterator[str]:
+            # Как и настоящий API, каждая строка содержит весь текст, сгенерированный к этому моменту
+            shown = ""
+            for piece in self.stream_text(text):
+                shown += piece
+                yield json.dumps(result(shown, "ALTERNATIVE_STATUS_PARTIAL"), ensure_ascii=False) + "\n"
+            yield json.dumps(result(text, "ALTERNATIVE_STATUS_FINAL"), ensure_ascii=False) + "\n"
+        self.send_stream(lines(), 'application/json')
+
+    def yandex_iam(self, request: dict) -> None:
+        self.send_json({"iamToken": "fake-iam-token", "expiresAt": "2100-01-01T00:00:00Z"})
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # При очереди по умолчанию (5) одновременные подключения теряются и ждут повторного SYN
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, latency: Optional[Latency] = None, answer_words: int = FAKE_ANSWER_WORDS):
+        super().__init__(("127.0.0.1", port), FakeProviderHandler)
+        self.latency = latency or Latency()
+        self.answer_words = answer_words
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+def serve(port: int, latency: Latency, answer_words: int) -> None:
+    FakeProviderServer(port, latency, answer_words).serve_forever()
+
+def start_process(latency: Latency, answer_words: int = FAKE_ANSWER_WORDS,
+                  timeout: float = 10.0) -> Tuple[multiprocessing.Process, str]:
+    # Заглушка в отдельном процессе не конкурирует за GIL с измеряемым ботом
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = multiprocessing.Process(target=serve, args=(port, latency, answer_words), daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            if time.monotonic() > deadline or not process.is_alive():
+                process.terminate()
+                raise RuntimeError("Fake providers did not start")
+            time.sleep(0.05)
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-ins for the OpenAI, Ollama and Yandex APIs')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--embedding-latency', type=float, default=Latency.embedding)
+    parser.add_argument('--completion-latency', type=float, default=Latency.completion)
+    parser.add_argument('--token-latency', type=float, default=Latency.token)
+    parser.add_argument('--answer-words', type=int, default=FAKE_ANSWER_WORDS, help='Length of generated answers')
+    args = parser.parse_args()
+
+    server = FakeProviderServer(args.port, Latency(args.embedding_latency, args.completion_latency, args.token_latency),
+                                args.answer_words)
+    print(f"Fake providers listening on {server.url}")
+    print(f"  OPENAI_BASE_URL={server.url}/v1")
+    print(f"  OLLAMA_URL={server.url}")
+    print(f"  YC_LLM_API_URL={server.url} YC_IAM_API_URL={server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import time
+import queue
+import argparse
+import hashlib
+import threading
+import pandas as pd
+from typing import Callable, Dict, Iterator, List, Optional, TypedDict
+from dotenv import load_dotenv
+from tqdm import tqdm
+from vector_store import get_chroma_client
+
+load_dotenv()
+
+COLLECTION_NAME = "questions"
+DATASET_PATH = os.getenv('DATASET_PATH', 'dataset.csv')
+SYNC_BATCH_SIZE = int(os.getenv('SYNC_BATCH_SIZE', '256'))
+PAGE_SIZE = 1000
+
+EmbedFn = Callable[[List[str]], List[Optional[List[float]]]]
+
+class KBRow(TypedDict):
+    id: str
+    question: str
+    answer: str
+    reference: str
+    row_hash: str
+
+def content_hash(*parts: str) -> str:
+    return hashlib.sha1("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+def cell(value) -> str:
+    return "" if pd.isna(value) else str(value)
+
+def read_dataset(path: str = DATASET_PATH) -> List[KBRow]:
+    df = pd.read_csv(path)
+    rows = []
+    seen: Dict[str, int] = {}
+    for question, answer, reference in zip(df['Вопрос'], df['Ответ'], df['Ссылка']):
+        question, answer, reference = cell(question), cell(answer), cell(reference)
+        # id зависит только от текста вопроса: эмбеддинг нужен заново, только если изменился вопрос
+        base_id = f"kb-{content_hash(question)[:32]}"
+        n = seen.get(base_id, 0)
+        seen[base_id] = n + 1
+        rows.append({
+            "id": base_id if n == 0 else f"{base_id}-{n}",
+            "question": question,
+            "answer": answer,
+            "reference": reference,
+            "row_hash": content_hash(question, answer, reference)
+        })
+    return rows
+
+def row_metadata(row: KBRow) -> dict:
+    return {"answer": row["answer"], "reference": row["reference"], "is_generated": False, "row_hash": row["row_hash"]}
+
+def chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def iter_pages(collection, include: List[str], where: Optional[dict] = None, page_size: int = PAGE_SIZE) -> Iterator[dict]:
+    offset = 0
+    while True:
+        page = collection.get(where=where, limit=page_size, offset=offset, include=include)
+        if page['ids']:
+            yield page
+        if len(page['ids']) < page_size:
+            return
+        offset += page_size
+
+def collection_dimension(collection) -> int:
+    sample = collection.get(limit=1, include=["embeddings"])
+    return len(sample['embeddings'][0]) if sample['ids'] else 0
+
+def fetch_existing(collection) -> Dict[str, Optional[str]]:
+    existing = {}
+    for page in iter_pages(collection, include=["metadatas"]):
+        for entry_id, metadata in zip(page['ids'], page['metadatas']):
+            metadata = metadata or {}
+            if not metadata.get('is_generated', False):
+                existing[entry_id] = metadata.get('row_hash')
+    return existing
+
+def embed_worker(batches: Iterator[List[KBRow]], lock: threading.Lock, embed_texts: EmbedFn, results: queue.Queue) -> None:
+    while True:
+        with lock:
+            batch = next(batches, None)
+        if batch is None:
+            return
+        try:
+            embeddings = embed_texts([row["question"] for row in batch])
+        except Exception as e:
+            print(f"Embedding error: {str(e)}")
+            embeddings = [None] * len(batch)
+        results.put((batch, embeddings))
+
+def write_rows(collection, rows: List[KBRow], embed_texts: EmbedFn, batch_size: int, workers: int = 1) -> List[KBRow]:
+    batches = list(chunks(rows, batch_size))
+    # Ограниченная очередь: эмбеддинги считаются параллельно с записью, но не копятся в памяти
+    results: queue.Queue = queue.Queue(maxsize=workers * 2)
+    lock = threading.Lock()
+    batch_iter = iter(batches)
+    for _ in range(workers):
+        threading.Thread(target=embed_worker, args=(batch_iter, lock, embed_texts, results), daemon=True).start()
+
+    failed = []
+    with tqdm(total=len(rows), desc="Processing") as progress:
+        for _ in batches:
+            batch, embeddings = results.get()
+            done = [(row, emb) for row, emb in zip(batch, embeddings) if emb is not None]
+            failed.extend(row for row, emb in zip(batch, embeddings) if emb is None)
+            # Каждая пачка сразу записывается в базу - после сбоя повторный запуск продолжит с этого места
+            if done:
+                collection.upsert(
+                    ids=[row["id"] for row, _ in done],
+                    embeddings=[emb for _, emb in done],
+                    documents=[row["question"] for row, _ in done],
+                    metadatas=[{**row_metadata(row), "created_at": int(time.time())} for row, _ in done]
+                )
+            progress.update(len(batch))
+    for row in failed:
+        print(f"Skipping question due to error: {row['question']}")
+    return failed
+
+def sync(collection, rows: List[KBRow], embed_texts: EmbedFn, batch_size: int = SYNC_BATCH_SIZE, workers: int = 1) -> None:
+    existing = fetch_existing(collection)
+    row_ids = {row["id"] for row in rows}
+
+    new_rows = [row for row in rows if row["id"] not in existing]
+    changed_rows = [row for row in rows if row["id"] in existing and existing[row["id"]] != row["row_hash"]]
+    removed_ids = [entry_id for entry_id in existing if entry_id not in row_ids]
+    print(f"New: {len(new_rows)}, changed: {len(changed_rows)}, removed: {len(removed_ids)}, "
+          f"unchanged: {len(rows) - len(new_rows) - len(changed_rows)}")
+
+    failed = []
+    if new_rows:
+        print("Generating embeddings...")
+        failed = write_rows(collection, new_rows, embed_texts, batch_size, workers)
+        if failed:
+            print(f"Warning: {len(failed)} questions were not embedded, run the sync again to retry them")
+
+    # Вопрос не изменился - меняем только ответ и ссылку, без нового эмбеддинга
+    for batch in chunks(changed_rows, PAGE_SIZE):
+        collection.update(
+            ids=[row["id"] for row in batch],
+            metadatas=[row_metadata(row) for row in batch]
+        )
+
+    # Удаляем в самом конце, чтобы при сбое база не оставалась без ответов. Измененный вопрос - это новая строка
+    # плюс удаленная старая, поэтому если какие-то новые строки не записались, старые пока оставляем
+    if failed and removed_ids:
+        print(f"Skipping removal of {len(removed_ids)} entries until all new questions are embedded")
+        removed_ids = []
+    for batch in chunks(removed_ids, PAGE_SIZE):
+        collection.delete(ids=batch)
+
+    if failed:
+        print("Database partially synchronized, run the sync again")
+    else:
+        print("Database synchronized successfully")
+
+def rebuild(client, rows: List[KBRow], embed_texts: EmbedFn, batch_size: int = SYNC_BATCH_SIZE, workers: int = 1) -> None:
+    try:
+        client.delete_collection(COLLECTION_NAME)
+        print("Removed existing collection")
+    except Exception:
+        pass
+
+    collection = client.create_collection(
+        name=COLLECTION_NAME,
+        metadata={"hnsw:space": "cosine"}
+    )
+    print("Generating embeddings...")
+    failed = write_rows(collection, rows, embed_texts, batch_size, workers)
+    if failed:
+        print("Warning: not all embeddings were successfully generated")
+    print("Database created and populated successfully")
+
+def load(embed_texts: EmbedFn, rebuild_all: bool = False, batch_size: int = SYNC_BATCH_SIZE, workers: int = 1) -> None:
+    print("Loading dataset...")
+    rows = read_dataset()
+
+    client = get_chroma_client()
+    if rebuild_all:
+        rebuild(client, rows, embed_texts, batch_size, workers)
+    else:
+        collection = client.get_or_create_collection(
+            name=COLLECTION_NAME,
+            metadata={"hnsw:space": "cosine"}
+        )
+        sync(collection, rows, embed_texts, batch_size, workers)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Load dataset.csv into ChromaDB')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Drop the collection (including generated answers) and embed everything again')
+    return parser.parse_args()
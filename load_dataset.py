@@ -1,56 +1,92 @@
-import chromadb
-import shutil
 import os
-import pandas as pd
+import time
+import random
+import openai
+import kb_sync
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
 from openai import OpenAI
 from dotenv import load_dotenv
-from tqdm import tqdm
+from tokenizer import count_tokens, truncate_tokens
 
 if 'EMBEDDING_MODEL' in os.environ:
     del os.environ['EMBEDDING_MODEL']
 load_dotenv()
 
-client_openai = OpenAI()
+# Повторы делаем сами, чтобы учитывать Retry-After и не ждать внутри клиента
+client_openai = OpenAI(max_retries=0)
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small')
+# 0 - полная размерность модели; у text-embedding-3-* можно запросить укороченные векторы
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '0'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '512'))
+EMBEDDING_BATCH_TOKENS = int(os.getenv('EMBEDDING_BATCH_TOKENS', '100000'))
+EMBEDDING_CONCURRENCY = int(os.getenv('EMBEDDING_CONCURRENCY', '4'))
+EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', '6'))
+# Ограничение модели на длину одного входа
+MAX_INPUT_TOKENS = 8191
 
-def get_embedding(text):
-    response = client_openai.embeddings.create(
-        model=EMBEDDING_MODEL,
-        input=text
-    )
-    return response.data[0].embedding
-
-def load_dataset():
-    if os.path.exists("./chroma_db"):
-        print("Removing existing database...")
-        shutil.rmtree("./chroma_db")
-    
-    client_chroma = chromadb.PersistentClient(path="./chroma_db")
-    collection = client_chroma.create_collection(
-        name="questions",
-        metadata={"hnsw:space": "cosine"}
-    )
-
-    print("Loading dataset...")
-    df = pd.read_csv('dataset.csv')
-    
-    questions = df['Вопрос'].tolist()
-    answers = df['Ответ'].tolist()
-    references = df['Ссылка'].tolist()
-    ids = [str(i) for i in range(len(questions))]
-    
-    print("Generating embeddings...")
-    embeddings = [get_embedding(q) for q in tqdm(questions, desc="Processing")]
-    
-    print("Adding data to ChromaDB...")
-    collection.add(
-        embeddings=embeddings,
-        documents=questions,
-        metadatas=[{"answer": a, "reference": r, "is_generated": False} for a, r in zip(answers, references)],
-        ids=ids
-    )
-    
-    print("Database created and populated successfully")
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+def make_batches(token_counts: List[int]) -> List[List[int]]:
+    batches = []
+    batch, batch_tokens = [], 0
+    for i, tokens in enumerate(token_counts):
+        if batch and (len(batch) >= EMBEDDING_BATCH_SIZE or batch_tokens + tokens > EMBEDDING_BATCH_TOKENS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    return min(60, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def embed_batch(texts: List[str]) -> List[List[float]]:
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            response = client_openai.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts,
+                **({"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {})
+            )
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except RETRYABLE_ERRORS as e:
+            if attempt == EMBEDDING_MAX_RETRIES:
+                raise
+            delay = retry_delay(e, attempt)
+            print(f"Embedding request failed ({type(e).__name__}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def get_embeddings(texts: List[str]) -> List[List[float]]:
+    texts = [truncate_tokens(text, MAX_INPUT_TOKENS, EMBEDDING_MODEL) for text in texts]
+    batches = make_batches([count_tokens(text, EMBEDDING_MODEL) for text in texts])
+
+    embeddings = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(embed_batch, [texts[i] for i in batch]): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            batch = futures[future]
+            # Раскладываем по исходным позициям, чтобы порядок строк не зависел от порядка ответов
+            for i, embedding in zip(batch, future.result()):
+                embeddings[i] = embedding
+    return embeddings
+
+def load_dataset(rebuild: bool = False):
+    # Сразу отдаем несколько пачек, чтобы все параллельные запросы были заняты
+    kb_sync.load(get_embeddings, rebuild_all=rebuild, batch_size=EMBEDDING_BATCH_SIZE * EMBEDDING_CONCURRENCY)
 
 if __name__ == "__main__":
-    load_dataset() 
\ No newline at end of file
+    load_dataset(rebuild=kb_sync.parse_args().rebuild)
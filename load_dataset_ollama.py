@@ -1,89 +1,57 @@
-import chromadb
-import shutil
 import os
-import pandas as pd
-from tqdm import tqdm
-import requests
-import json
+import kb_sync
+from typing import List, Optional
 from dotenv import load_dotenv
+from http_client import get_session
 
 load_dotenv()
 
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'evilfreelancer/enbeddrus')
+OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_TIMEOUT = float(os.getenv('OLLAMA_TIMEOUT', '120'))
+OLLAMA_EMBED_BATCH_SIZE = int(os.getenv('OLLAMA_EMBED_BATCH_SIZE', '32'))
+OLLAMA_EMBED_WORKERS = int(os.getenv('OLLAMA_EMBED_WORKERS', '2'))
 
-def get_embedding(text: str) -> list:
+def embed(texts: List[str]) -> List[List[float]]:
+    response = get_session().post(
+        f'{OLLAMA_URL}/api/embed',
+        json={
+            'model': EMBEDDING_MODEL,
+            'input': texts
+        },
+        timeout=OLLAMA_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()['embeddings']
+
+def get_embedding(text: str) -> Optional[list]:
     try:
-        response = requests.post(
-            'http://localhost:11434/api/embeddings',
-            json={
-                'model': EMBEDDING_MODEL,
-                'prompt': text
-            }
-        )
-        if response.status_code == 200:
-            return response.json()['embedding']
-        else:
-            print(f"Error getting embedding: {response.status_code}")
-            return None
+        return embed([text])[0]
     except Exception as e:
         print(f"Ollama request error: {str(e)}")
         return None
 
-def load_dataset():
-    if os.path.exists("./chroma_db"):
-        print("Removing existing database...")
-        shutil.rmtree("./chroma_db")
-    
-    client_chroma = chromadb.PersistentClient(path="./chroma_db")
-    collection = client_chroma.create_collection(
-        name="questions",
-        metadata={"hnsw:space": "cosine"}
-    )
+def get_embeddings(texts: List[str]) -> List[Optional[list]]:
+    try:
+        return embed(texts)
+    except Exception as e:
+        # Пачка целиком не прошла - повторяем по одному, чтобы потерять только проблемные вопросы
+        print(f"Batch embedding error: {str(e)}, retrying one by one")
+        return [get_embedding(text) for text in texts]
 
-    print("Loading dataset...")
-    df = pd.read_csv('dataset.csv')
-    
-    questions = df['Вопрос'].tolist()
-    answers = df['Ответ'].tolist()
-    references = df['Ссылка'].tolist()
-    ids = [str(i) for i in range(len(questions))]
-    
-    print("Generating embeddings...")
-    embeddings = []
-    for q in tqdm(questions, desc="Processing"):
-        emb = get_embedding(q)
-        if emb is None:
-            print(f"Skipping question due to error: {q}")
-            continue
-        embeddings.append(emb)
-    
-    if len(embeddings) != len(questions):
-        print("Warning: not all embeddings were successfully generated")
-        valid_indices = list(range(len(embeddings)))
-        questions = [questions[i] for i in valid_indices]
-        answers = [answers[i] for i in valid_indices]
-        references = [references[i] for i in valid_indices]
-        ids = [str(i) for i in range(len(embeddings))]
-    
-    print("Adding data to ChromaDB...")
-    collection.add(
-        embeddings=embeddings,
-        documents=questions,
-        metadatas=[{"answer": a, "reference": r} for a, r in zip(answers, references)],
-        ids=ids
-    )
-    
-    print("Database created and populated successfully")
+def load_dataset(rebuild: bool = False):
+    kb_sync.load(get_embeddings, rebuild_all=rebuild, batch_size=OLLAMA_EMBED_BATCH_SIZE, workers=OLLAMA_EMBED_WORKERS)
 
 if __name__ == "__main__":
+    args = kb_sync.parse_args()
     try:
-        response = requests.get('http://localhost:11434/api/tags')
+        response = get_session().get(f'{OLLAMA_URL}/api/tags')
         if response.status_code != 200:
             print("Error: Ollama server is not available")
             exit(1)
     except Exception as e:
         print(f"Error connecting to Ollama: {str(e)}")
-        print("Make sure Ollama is running and available at localhost:11434")
+        print(f"Make sure Ollama is running and available at {OLLAMA_URL}")
         exit(1)
         
-    load_dataset() 
\ No newline at end of file
+    load_dataset(rebuild=args.rebuild)
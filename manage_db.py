@@ -1,74 +1,315 @@
-import chromadb
+import os
+import glob
+import sqlite3
+import json
+import mmap
+import struct
 import argparse
-from typing import Tuple
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from answer_writer import GENERATED_DEDUP_RELEVANCE, merge_metadata
+from kb_sync import COLLECTION_NAME, PAGE_SIZE, chunks, collection_dimension, iter_pages
+from vector_index import NUMPY_INDEX_PATH, export_numpy_index, normalize_rows, recall_report
+from vector_store import CHROMA_PATH, get_chroma_client
 
-def get_stats() -> Tuple[int, int]:
-    client = chromadb.PersistentClient(path="./chroma_db")
+# Сколько ближайших соседей проверять для каждой записи при поиске дубликатов
+DEDUP_NEIGHBORS = 10
+# Сколько последних дней показывать в статистике по дням
+STATS_DAYS = 14
+# Начало header.bin индекса hnswlib: версия, offsetLevel0, max_elements, cur_element_count,
+# size_data_per_element, label_offset, offsetData
+HNSW_HEADER = struct.Struct('<iQQQQQQ')
+HNSW_DELETE_MARK = 0x01
+# Chroma сбрасывает HNSW-индекс на диск раз в hnsw:sync_threshold записей (значение по умолчанию)
+HNSW_SYNC_THRESHOLD = 1000
+
+def get_disk_size(path: str = CHROMA_PATH) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def vector_segment_dirs(collection, path: str = CHROMA_PATH) -> List[str]:
+    # В базе могут быть и другие коллекции (например, копия после --migrate-dimensions)
+    try:
+        with sqlite3.connect(f"file:{os.path.join(path, 'chroma.sqlite3')}?mode=ro", uri=True) as db:
+            rows = db.execute("SELECT id FROM segments WHERE collection = ? AND scope = 'VECTOR'",
+                              (str(collection.id),)).fetchall()
+        return [os.path.join(path, row[0]) for row in rows]
+    except sqlite3.Error:
+        return [os.path.dirname(header) for header in glob.glob(os.path.join(path, "*", "header.bin"))]
+
+def get_hnsw_stats(collection, path: str = CHROMA_PATH) -> Dict[str, int]:
+    # Читаем заголовок hnswlib и флаги удаления прямо из файлов индекса, не загружая его в память.
+    # Это снимок на момент последнего сброса на диск: записи после него в файлах еще не видны
+    stats = {"segments": 0, "elements": 0, "tombstones": 0, "max_elements": 0}
+    for segment_dir in vector_segment_dirs(collection, path):
+        header_path = os.path.join(segment_dir, "header.bin")
+        if not os.path.exists(header_path):
+            continue
+        with open(header_path, 'rb') as f:
+            header = f.read(HNSW_HEADER.size)
+        if len(header) < HNSW_HEADER.size:
+            continue
+        stats["segments"] += 1
+        _, offset_level0, max_elements, elements, size_per_element, _, _ = HNSW_HEADER.unpack(header)
+        stats["elements"] += elements
+        stats["max_elements"] += max_elements
+
+        data_path = os.path.join(os.path.dirname(header_path), "data_level0.bin")
+        if not elements or not os.path.exists(data_path) or os.path.getsize(data_path) < elements * size_per_element:
+            continue
+        with open(data_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for i in range(elements):
+                # Третий байт заголовка списка связей нулевого уровня - флаг удаления
+                if data[i * size_per_element + offset_level0 + 2] & HNSW_DELETE_MARK:
+                    stats["tombstones"] += 1
+    return stats
+
+def hnsw_snapshot(collection, total_count: int) -> dict:
+    stats = get_hnsw_stats(collection)
+    stats["sync_threshold"] = int((collection.metadata or {}).get("hnsw:sync_threshold", HNSW_SYNC_THRESHOLD))
+    # Сколько записей коллекции еще не попало в файлы индекса (отрицательное - удаления еще не сброшены)
+    stats["unpersisted"] = total_count - (stats["elements"] - stats["tombstones"])
+    return stats
+
+def get_stats(days: int = STATS_DAYS) -> dict:
+    client = get_chroma_client()
     collection = client.get_collection("questions")
-    
-    results = collection.get(
-        include=["metadatas"]
-    )
-    
-    total_count = len(results['metadatas'])
-    generated_count = sum(1 for meta in results['metadatas'] if meta.get('is_generated', False))
-    
-    return total_count, generated_count
 
-def delete_generated() -> int:
-    client = chromadb.PersistentClient(path="./chroma_db")
+    total_count = collection.count()
+    generated_count = count_generated(collection)
+
+    dimension = collection_dimension(collection)
+
+    # Размеры ответов и распределение по дням считаем постранично, не держа всю базу в памяти
+    answer_chars = {"generated": 0, "original": 0}
+    by_day: Dict[str, Dict[str, int]] = {}
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    for page in iter_pages(collection, include=["metadatas"]):
+        for metadata in page['metadatas']:
+            metadata = metadata or {}
+            kind = "generated" if metadata.get('is_generated', False) else "original"
+            answer_chars[kind] += len(str(metadata.get('answer', '')))
+            created_at = metadata.get('created_at')
+            day = datetime.fromtimestamp(created_at).strftime("%Y-%m-%d") if created_at else "unknown"
+            if day != "unknown" and day < since:
+                day = "earlier"
+            by_day.setdefault(day, {"generated": 0, "original": 0})[kind] += 1
+
+    original_count = total_count - generated_count
+    return {
+        "total": total_count,
+        "generated": generated_count,
+        "original": original_count,
+        "embedding_dimension": dimension,
+        "disk_bytes": get_disk_size(),
+        "hnsw": hnsw_snapshot(collection, total_count),
+        "avg_answer_chars": {
+            "generated": round(answer_chars["generated"] / generated_count, 1) if generated_count else 0,
+            "original": round(answer_chars["original"] / original_count, 1) if original_count else 0
+        },
+        "by_day": dict(sorted(by_day.items()))
+    }
+
+def print_stats(stats: dict) -> None:
+    print(f"Всего записей: {stats['total']}")
+    print(f"Сгенерированных записей: {stats['generated']}")
+    print(f"Оригинальных записей: {stats['original']}")
+    print(f"Размерность эмбеддингов: {stats['embedding_dimension']}")
+    print(f"Размер базы на диске: {stats['disk_bytes'] / 1024 / 1024:.1f} МБ")
+    hnsw = stats['hnsw']
+    if not hnsw['segments']:
+        print("HNSW: файлы индекса на диске не найдены (индекс еще не сброшен на диск или CHROMA_PATH указывает не на каталог базы)")
+    else:
+        print(f"HNSW, снимок на диске (сбрасывается раз в {hnsw['sync_threshold']} записей): элементов {hnsw['elements']}, "
+              f"удаленных (tombstones) {hnsw['tombstones']}, емкость {hnsw['max_elements']}")
+        if hnsw['unpersisted']:
+            print(f"  расхождение с коллекцией: {hnsw['unpersisted']} записей еще не сброшены на диск")
+    print(f"Средний размер ответа: оригинальные {stats['avg_answer_chars']['original']} симв., "
+          f"сгенерированные {stats['avg_answer_chars']['generated']} симв.")
+    print("Записи по дням (оригинальные / сгенерированные):")
+    for day, counts in stats['by_day'].items():
+        print(f"  {day}: {counts['original']} / {counts['generated']}")
+
+def count_generated(collection) -> int:
+    return sum(len(page['ids']) for page in iter_pages(collection, include=[], where={"is_generated": True}))
+
+def delete_generated(dry_run: bool = False) -> int:
+    client = get_chroma_client()
     collection = client.get_collection("questions")
-    
-    results = collection.get(
-        include=["metadatas", "documents", "embeddings"]
-    )
-    
-    keep_indices = [
-        i for i, meta in enumerate(results['metadatas'])
-        if not meta.get('is_generated', False)
+
+    if dry_run:
+        return count_generated(collection)
+
+    # Удаляем на месте постранично: читаем только id, эмбеддинги и оригинальные записи не трогаем
+    deleted = 0
+    while True:
+        page = collection.get(where={"is_generated": True}, limit=PAGE_SIZE, include=[])
+        if not page['ids']:
+            return deleted
+        collection.delete(ids=page['ids'])
+        deleted += len(page['ids'])
+
+def dedup_generated(threshold: float) -> Tuple[int, int]:
+    client = get_chroma_client()
+    collection = client.get_collection("questions")
+
+    # Сначала только id: удаление во время постраничного чтения сдвигало бы страницы
+    generated_ids = [
+        entry_id
+        for page in iter_pages(collection, include=[], where={"is_generated": True})
+        for entry_id in page['ids']
     ]
-    
-    if not keep_indices:
-        print("Нет записей для сохранения")
-        return 0
-    
-    client.delete_collection("questions")
-    new_collection = client.create_collection(
-        name="questions",
-        metadata={"hnsw:space": "cosine"}
-    )
-    
-    new_collection.add(
-        ids=[str(i) for i in range(len(keep_indices))],
-        embeddings=[results['embeddings'][i] for i in keep_indices],
-        documents=[results['documents'][i] for i in keep_indices],
-        metadatas=[results['metadatas'][i] for i in keep_indices]
-    )
-    
-    deleted_count = len(results['embeddings']) - len(keep_indices)
-    return deleted_count
+
+    kept = set()
+    removed = set()
+    for batch_ids in chunks(generated_ids, 100):
+        batch_ids = [entry_id for entry_id in batch_ids if entry_id not in removed]
+        if not batch_ids:
+            continue
+        batch = collection.get(ids=batch_ids, include=["embeddings", "metadatas"])
+        neighbors = collection.query(
+            query_embeddings=batch['embeddings'],
+            n_results=DEDUP_NEIGHBORS,
+            where={"is_generated": True},
+            include=["metadatas", "distances"]
+        )
+
+        updates = {}
+        deletes = []
+        for entry_id, metadata, found_ids, found_metadatas, distances in zip(
+            batch['ids'], batch['metadatas'], neighbors['ids'], neighbors['metadatas'], neighbors['distances']
+        ):
+            if entry_id in removed:
+                continue
+            # Псевдонимы (alias_of) из прежних версий бота - копии ответа другой записи, они удаляются,
+            # а запись, на которую они ссылались, остается на месте
+            if metadata.get("alias_of"):
+                removed.add(entry_id)
+                deletes.append(entry_id)
+                continue
+            kept.add(entry_id)
+            # Все близкие соседи сливаются в текущую запись, она остается представителем кластера
+            # со своим ответом и источниками
+            for found_id, found_metadata, distance in zip(found_ids, found_metadatas, distances):
+                if found_id in kept or found_id in removed or found_metadata.get("alias_of") or 1 - distance < threshold:
+                    continue
+                metadata = merge_metadata(metadata, 1 + found_metadata.get("merged_count", 0))
+                updates[entry_id] = metadata
+                removed.add(found_id)
+                deletes.append(found_id)
+
+        if updates:
+            collection.update(ids=list(updates), metadatas=list(updates.values()))
+        if deletes:
+            collection.delete(ids=deletes)
+
+    return len(generated_ids), len(removed)
+
+def export_numpy(path: str) -> int:
+    client = get_chroma_client()
+    return export_numpy_index(client.get_collection("questions"), path)
+
+def migrate_dimensions(dimensions: int, drop_backup: bool = False) -> Tuple[int, str]:
+    client = get_chroma_client()
+    collection = client.get_collection(COLLECTION_NAME)
+    current = collection_dimension(collection)
+    if not current:
+        raise ValueError("Коллекция пуста")
+    if dimensions >= current:
+        raise ValueError(f"Размерность можно только уменьшить (сейчас {current})")
+    backup_name = f"{COLLECTION_NAME}_backup_{current}"
+    if backup_name in [c.name if hasattr(c, 'name') else c for c in client.list_collections()]:
+        raise ValueError(f"Коллекция {backup_name} уже существует, удалите ее перед миграцией")
+
+    # Новая коллекция заполняется рядом со старой, бот продолжает работать со старой до переименования
+    target_name = f"{COLLECTION_NAME}_{dimensions}"
+    try:
+        client.delete_collection(target_name)
+    except Exception:
+        pass
+    target = client.create_collection(name=target_name, metadata=collection.metadata or {"hnsw:space": "cosine"})
+
+    migrated = 0
+    for page in iter_pages(collection, include=["embeddings", "documents", "metadatas"]):
+        # Векторы text-embedding-3-* после обрезки и нормализации совпадают с ответом API с dimensions=N
+        vectors = normalize_rows(np.asarray(page['embeddings'], dtype=np.float32)[:, :dimensions])
+        target.add(ids=page['ids'], embeddings=vectors, documents=page['documents'], metadatas=page['metadatas'])
+        migrated += len(page['ids'])
+
+    collection.modify(name=backup_name)
+    target.modify(name=COLLECTION_NAME)
+    if drop_backup:
+        client.delete_collection(backup_name)
+    return migrated, backup_name
 
 def main():
     parser = argparse.ArgumentParser(description='Утилита для управления базой данных ChromaDB')
     parser.add_argument('--stats', action='store_true', help='Показать статистику базы данных')
+    parser.add_argument('--json', action='store_true', help='Вместе с --stats: вывести статистику в JSON (для мониторинга)')
     parser.add_argument('--delete-generated', action='store_true', help='Удалить все сгенерированные записи')
+    parser.add_argument('--dry-run', action='store_true', help='Вместе с --delete-generated: только посчитать записи, ничего не удаляя')
+    parser.add_argument('--dedup-generated', action='store_true', help='Слить почти одинаковые сгенерированные записи')
+    parser.add_argument('--threshold', type=float, default=GENERATED_DEDUP_RELEVANCE,
+                        help='Минимальная релевантность для слияния записей (по умолчанию GENERATED_DEDUP_RELEVANCE)')
+    parser.add_argument('--export-numpy', nargs='?', const=NUMPY_INDEX_PATH, metavar='PATH',
+                        help='Выгрузить базу в индекс для RETRIEVAL_BACKEND=numpy (по умолчанию NUMPY_INDEX_PATH)')
+    parser.add_argument('--migrate-dimensions', type=int, metavar='N',
+                        help='Укоротить векторы базы до N измерений (только для моделей text-embedding-3-*), '
+                             'затем задать EMBEDDING_DIMENSIONS=N')
+    parser.add_argument('--drop-backup', action='store_true',
+                        help='Вместе с --migrate-dimensions: удалить старую коллекцию после миграции')
+    parser.add_argument('--recall-report', action='store_true',
+                        help='Сравнить поиск по квантованным float16/int8 векторам с точным float32 (индекс NUMPY_INDEX_PATH)')
+    parser.add_argument('--queries', type=int, default=200, help='Вместе с --recall-report: число тестовых запросов')
     
     args = parser.parse_args()
     
-    if not args.stats and not args.delete_generated:
+    if not args.stats and not args.delete_generated and not args.dedup_generated and not args.export_numpy \
+            and not args.recall_report and not args.migrate_dimensions:
         parser.print_help()
         return
     
     try:
         if args.stats:
-            total, generated = get_stats()
-            print(f"Всего записей: {total}")
-            print(f"Сгенерированных записей: {generated}")
-            print(f"Оригинальных записей: {total - generated}")
+            stats = get_stats()
+            if args.json:
+                print(json.dumps(stats, ensure_ascii=False))
+            else:
+                print_stats(stats)
         
         if args.delete_generated:
-            deleted = delete_generated()
-            print(f"Удалено {deleted} сгенерированных записей")
+            deleted = delete_generated(dry_run=args.dry_run)
+            if args.dry_run:
+                print(f"Будет удалено {deleted} сгенерированных записей")
+            else:
+                print(f"Удалено {deleted} сгенерированных записей")
+
+        if args.dedup_generated:
+            total, merged = dedup_generated(args.threshold)
+            print(f"Проверено {total} сгенерированных записей, слито дубликатов: {merged}")
+
+        if args.migrate_dimensions:
+            migrated, backup_name = migrate_dimensions(args.migrate_dimensions, args.drop_backup)
+            print(f"Перенесено {migrated} записей с размерностью {args.migrate_dimensions}")
+            if not args.drop_backup:
+                print(f"Старая коллекция сохранена как {backup_name}")
+            print(f"Установите EMBEDDING_DIMENSIONS={args.migrate_dimensions} в .env и перезапустите бота "
+                  f"(при RETRIEVAL_BACKEND=numpy - заново выполните --export-numpy)")
+
+        if args.export_numpy:
+            exported = export_numpy(args.export_numpy)
+            print(f"Выгружено {exported} записей в {args.export_numpy}")
+
+        if args.recall_report:
+            print(f"{'формат':<10}{'пересчет':>10}{'recall@5':>10}{'в памяти, МБ':>14}{'поиск, мс':>11}")
+            for row in recall_report(queries=args.queries):
+                rescore = f"x{row['rescore_factor']}" if row['rescore_factor'] else "-"
+                print(f"{row['dtype']:<10}{rescore:>10}{row['recall']:>10.3f}"
+                      f"{row['resident_bytes'] / 1024 / 1024:>14.2f}{row['search_ms']:>11.3f}")
             
     except Exception as e:
         print(f"Ошибка: {str(e)}")
@@ -0,0 +1,86 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+from dotenv import load_dotenv
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+
+load_dotenv()
+
+# Порт для /metrics в формате Prometheus (0 - не запускать)
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_ADDR = os.getenv('METRICS_ADDR', '127.0.0.1')
+EVENT_LOOP_PROBE_INTERVAL = 0.5
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    'kb_bot_stage_seconds', 'Duration of a bot pipeline stage',
+    ['stage', 'provider', 'model'], buckets=LATENCY_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    'kb_bot_request_seconds', 'Time from receiving a question to the final reply',
+    ['outcome', 'provider', 'model'], buckets=LATENCY_BUCKETS
+)
+OUTCOMES = Counter(
+    'kb_bot_answers', 'Answered questions by outcome',
+    ['outcome', 'provider', 'model']
+)
+CONTEXT_TOKENS_SAVED = Counter(
+    'kb_bot_context_tokens_saved', 'Prompt tokens removed by context deduplication, merging and budgeting',
+    ['model']
+)
+MICRO_BATCH_SIZE = Histogram(
+    'kb_bot_micro_batch_size', 'Number of concurrent requests sent as one provider call',
+    ['kind'], buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+EMBEDDING_CACHE_LOOKUPS = Counter(
+    'kb_bot_embedding_cache_lookups', 'Embedding cache lookups by result (memory_hit, disk_hit, miss)',
+    ['result', 'provider', 'model']
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    'kb_bot_event_loop_lag_seconds', 'How late the event loop wakes up a sleeping task',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+@contextmanager
+def timed(stage: str, provider: str, model: str = "") -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage, provider, model).observe(time.perf_counter() - started)
+
+def record_outcome(outcome: str, provider: str, model: str, seconds: float) -> None:
+    OUTCOMES.labels(outcome, provider, model).inc()
+    REQUEST_SECONDS.labels(outcome, provider, model).observe(seconds)
+
+async def monitor_event_loop(interval: float = EVENT_LOOP_PROBE_INTERVAL) -> None:
+    # Задержка пробуждения показывает, что цикл событий занят синхронной работой, а не ждет провайдеров
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - started - interval))
+
+class EmbeddingCacheCollector:
+    # Число записей считается в момент опроса /metrics, а не при каждом обращении к кэшу
+    def __init__(self, stats: Callable[[], Dict[str, int]]):
+        self.stats = stats
+
+    def collect(self):
+        stats = self.stats()
+        entries = GaugeMetricFamily('kb_bot_embedding_cache_entries', 'Embeddings stored in the cache', labels=['tier'])
+        entries.add_metric(['memory'], stats["memory_entries"])
+        entries.add_metric(['disk'], stats["disk_entries"])
+        yield entries
+
+def export_embedding_cache(stats: Callable[[], Dict[str, int]]) -> None:
+    REGISTRY.register(EmbeddingCacheCollector(stats))
+
+def start_metrics_server(port: int = METRICS_PORT, addr: str = METRICS_ADDR) -> bool:
+    if not port:
+        return False
+    start_http_server(port, addr=addr)
+    return True
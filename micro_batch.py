@@ -0,0 +1,86 @@
+import os
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, List, Set, Tuple
+from dotenv import load_dotenv
+from metrics import MICRO_BATCH_SIZE
+
+load_dotenv()
+
+# Сколько ждать попутные запросы перед отправкой пачки (0 - только пришедшие в ту же итерацию event loop)
+MICRO_BATCH_WINDOW = float(os.getenv('MICRO_BATCH_WINDOW', '0.01'))
+# Максимальный размер пачки (1 - без объединения)
+MICRO_BATCH_MAX_SIZE = int(os.getenv('MICRO_BATCH_MAX_SIZE', '32'))
+
+# handler(group, items) -> результаты в том же порядке, что и items
+BatchHandler = Callable[[Hashable, list], Awaitable[list]]
+
+class MicroBatcher:
+    def __init__(self, kind: str, handler: BatchHandler, window: float = MICRO_BATCH_WINDOW,
+                 max_size: int = MICRO_BATCH_MAX_SIZE):
+        self.kind = kind
+        self.handler = handler
+        self.window = window
+        self.max_size = max(1, max_size)
+        # Запросы с разными параметрами (например, фильтром where) собираются в разные пачки
+        self.pending: Dict[Hashable, List[Tuple[object, asyncio.Future]]] = {}
+        self.timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, item, group: Hashable = None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending.setdefault(group, [])
+        batch.append((item, future))
+        if len(batch) >= self.max_size:
+            self.flush(group)
+        elif len(batch) == 1:
+            if self.window > 0:
+                self.timers[group] = loop.call_later(self.window, self.flush, group)
+            else:
+                self.timers[group] = loop.call_soon(self.flush, group)
+        return await future
+
+    def flush(self, group: Hashable) -> None:
+        timer = self.timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.pending.pop(group, None)
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self.run(group, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, group: Hashable, batch: List[Tuple[object, asyncio.Future]]) -> None:
+        MICRO_BATCH_SIZE.labels(self.kind).observe(len(batch))
+        try:
+            results = await self.handler(group, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.kind}: получено {len(results)} результатов на {len(batch)} запросов")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # Задача пачки отменена (например, при остановке бота) - ожидающие не должны зависнуть
+            for _, future in batch:
+                future.cancel()
+            raise
+        for (_, future), result in zip(batch, results):
+            # Вызывающий мог быть отменен, пока пачка выполнялась
+            if not future.done():
+                future.set_result(result)
+
+def unique_items(items: list) -> Tuple[list, List[int]]:
+    # Одинаковые запросы в пачке отправляются один раз
+    positions: Dict[Hashable, int] = {}
+    unique = []
+    for item in items:
+        if item not in positions:
+            positions[item] = len(unique)
+            unique.append(item)
+    return unique, [positions[item] for item in items]
+
+def spread(results: list, positions: List[int]) -> list:
+    return [results[position] for position in positions]
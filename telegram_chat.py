@@ -1,30 +1,30 @@
 import os
-import chromadb
+import asyncio
 from openai import OpenAI
 from dotenv import load_dotenv
 from typing import Optional, List, Dict
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from embedding_cache import get_embedding_cache, model_with_dimensions
+from bot_runtime import get_collection, run_bot, warm_collection, warm_up
+from vector_store import database_exists
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-if not OPENAI_API_KEY:
-    print("Не найден ключ OPENAI_API_KEY в переменных окружения, добавьте его в .env файл")
-    exit(1)
-
-client_openai = OpenAI(api_key=OPENAI_API_KEY)
-
 TEMPERATURE = float(os.getenv('TEMPERATURE', 0.3))
 MIN_RELEVANCE = float(os.getenv('MIN_RELEVANCE', 0.7))
 MAX_INPUT_TOKENS = int(os.getenv('MAX_INPUT_TOKENS', 1000))
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', 0))
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-if not TELEGRAM_TOKEN:
-    print("Не найден токен TELEGRAM_TOKEN в переменных окружения, добавьте его в .env файл")
-    exit(1)
 
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_collection("questions")
+_client_openai: Optional[OpenAI] = None
+
+def get_openai_client() -> OpenAI:
+    global _client_openai
+    if _client_openai is None:
+        _client_openai = OpenAI(api_key=OPENAI_API_KEY)
+    return _client_openai
 
 def get_embedding(text: str) -> Optional[List[float]]:
     try:
@@ -33,12 +33,21 @@ def get_embedding(text: str) -> Optional[List[float]]:
         if len(text) > MAX_INPUT_TOKENS * 4:
             print("Предупреждение: текст слишком длинный, будет использована только его часть")
             text = text[:MAX_INPUT_TOKENS * 4]
+
+        cache = get_embedding_cache()
+        cache_model = model_with_dimensions('text-embedding-3-small', EMBEDDING_DIMENSIONS)
+        cached = cache.get("openai", cache_model, text)
+        if cached is not None:
+            return cached
         
-        response = client_openai.embeddings.create(
+        response = get_openai_client().embeddings.create(
             model='text-embedding-3-small',
-            input=text
+            input=text,
+            **({"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {})
         )
-        return response.data[0].embedding
+        embedding = response.data[0].embedding
+        cache.put("openai", cache_model, text, embedding)
+        return embedding
     except Exception as e:
         print(f"Ошибка при получении эмбеддинга: {str(e)}")
         return None
@@ -49,7 +58,7 @@ def get_relevant_context(query: str) -> List[Dict]:
         return []
         
     try:
-        results = collection.query(
+        results = get_collection().query(
             query_embeddings=[query_embedding],
             n_results=5,
             include=["documents", "metadatas", "distances"]
@@ -127,7 +136,7 @@ def generate_response(query: str, context: List[Dict]) -> str:
     #print(f"User prompt: {user_prompt}")
     
     try:
-        response = client_openai.chat.completions.create(
+        response = get_openai_client().chat.completions.create(
             model="gpt-4",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -175,19 +184,38 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     else:
         await update.message.reply_text(response)
 
+def warm_up_embedding() -> None:
+    get_openai_client().embeddings.create(
+        model='text-embedding-3-small',
+        input="прогрев",
+        **({"dimensions": EMBEDDING_DIMENSIONS} if EMBEDDING_DIMENSIONS else {})
+    )
+
+async def post_init(application: Application) -> None:
+    # Индекс в памяти и соединение с OpenAI готовы до первого сообщения
+    await warm_up([
+        ("ChromaDB", lambda: asyncio.to_thread(warm_collection, get_collection())),
+        ("OpenAI embeddings", lambda: asyncio.to_thread(warm_up_embedding))
+    ])
+
 def main() -> None:
-    if not os.path.exists("./chroma_db"):
+    if not OPENAI_API_KEY:
+        print("Не найден ключ OPENAI_API_KEY в переменных окружения, добавьте его в .env файл")
+        exit(1)
+    if not TELEGRAM_TOKEN:
+        print("Не найден токен TELEGRAM_TOKEN в переменных окружения, добавьте его в .env файл")
+        exit(1)
+    if not database_exists():
         print("База данных не найдена. Сначала запустите load_dataset.py")
         return
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    print("Бот запущен")
-    application.run_polling()
+    run_bot(application)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
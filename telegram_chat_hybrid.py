@@ -1,15 +1,33 @@
 import os
-import chromadb
-from openai import OpenAI
+import re
+import time
+import asyncio
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
-from typing import Optional, List, Dict, TypedDict
+from typing import Optional, List, Dict, Sequence, Tuple, TypedDict, Callable, Awaitable
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 import json
+import logging
 from dataclasses import dataclass
+from weakref import WeakValueDictionary
+from embedding_cache import get_embedding_cache, model_with_dimensions, normalize_text
+from telegram_stream import STREAM_RESPONSES, StreamingReply, reply_long
+from answer_writer import GeneratedAnswerWriter
+from metrics import CONTEXT_TOKENS_SAVED, export_embedding_cache, monitor_event_loop, record_outcome, start_metrics_server, timed
+from log import fields, new_request_id, setup_logging
+from vector_index import open_vector_index
+from kb_sync import collection_dimension
+from bot_runtime import StartupError, get_collection, run_bot, warm_collection, warm_up
+from vector_store import database_exists
+from micro_batch import MicroBatcher, spread, unique_items
+from tokenizer import count_chat_tokens, count_tokens, preload_encodings, truncate_tokens
+from context_selection import merge_by_reference, select_context
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 @dataclass
 class Config:
     openai_api_key: str
@@ -17,9 +35,16 @@ class Config:
     temperature: float
     min_relevance: float
     max_input_tokens: int
+    token_budget: int
+    max_answer_tokens: int
+    min_answer_tokens: int
     direct_answer_relevance: float
     embedding_model: str
+    embedding_dimensions: int
     generation_model: str
+    concurrent_updates: int
+    max_concurrent_generations: int
+    stream_responses: bool
     
     @classmethod
     def from_env(cls) -> 'Config':
@@ -39,16 +64,66 @@ class Config:
             temperature=float(os.getenv('TEMPERATURE', '0.1')),
             min_relevance=float(os.getenv('MIN_RELEVANCE', '0.9')),
             max_input_tokens=int(os.getenv('MAX_INPUT_TOKENS', '1000')),
+            token_budget=int(os.getenv('TOKEN_BUDGET', '4000')),
+            max_answer_tokens=int(os.getenv('MAX_ANSWER_TOKENS', '1000')),
+            min_answer_tokens=int(os.getenv('MIN_ANSWER_TOKENS', '300')),
             direct_answer_relevance=float(os.getenv('DIRECT_ANSWER_RELEVANCE', '0.98')),
             embedding_model=os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small'),
-            generation_model=os.getenv('GENERATION_MODEL', 'gpt-4')
+            embedding_dimensions=int(os.getenv('EMBEDDING_DIMENSIONS', '0')),
+            generation_model=os.getenv('GENERATION_MODEL', 'gpt-4'),
+            concurrent_updates=int(os.getenv('CONCURRENT_UPDATES', '32')),
+            max_concurrent_generations=int(os.getenv('MAX_CONCURRENT_GENERATIONS', '4')),
+            stream_responses=STREAM_RESPONSES
+        )
+
+_config: Optional[Config] = None
+_client_openai: Optional[AsyncOpenAI] = None
+_vector_index = None
+_answer_writer: Optional[GeneratedAnswerWriter] = None
+_generation_semaphore: Optional[asyncio.Semaphore] = None
+
+# Настройки, клиенты и база создаются при первом обращении: импорт модуля ничего не открывает
+def get_config() -> Config:
+    global _config
+    if _config is None:
+        _config = Config.from_env()
+    return _config
+
+def get_openai_client() -> AsyncOpenAI:
+    global _client_openai
+    if _client_openai is None:
+        _client_openai = AsyncOpenAI(api_key=get_config().openai_api_key)
+    return _client_openai
+
+def get_vector_index():
+    # Поиск идет через выбранный RETRIEVAL_BACKEND, Chroma остается основным хранилищем
+    global _vector_index
+    if _vector_index is None:
+        _vector_index = open_vector_index(get_collection())
+    return _vector_index
+
+def get_answer_writer() -> GeneratedAnswerWriter:
+    # Сгенерированные ответы пишутся в базу в фоне, пачками
+    global _answer_writer
+    if _answer_writer is None:
+        _answer_writer = GeneratedAnswerWriter(
+            get_collection(),
+            mirror=get_vector_index(),
+            # Индекс точных совпадений отдает только то, что записано в базу: слитые перефразировки в него не попадают
+            on_saved=lambda question, answer, reference: exact_index.add(question, answer, reference, is_generated=True)
         )
+    return _answer_writer
 
-config = Config.from_env()
+def get_generation_semaphore() -> asyncio.Semaphore:
+    # Ограничивает число одновременных запросов к генеративной модели
+    global _generation_semaphore
+    if _generation_semaphore is None:
+        _generation_semaphore = asyncio.Semaphore(get_config().max_concurrent_generations)
+    return _generation_semaphore
 
-client_openai = OpenAI(api_key=config.openai_api_key)
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_collection("questions")
+# Сообщения одного чата обрабатываются строго по очереди
+chat_locks: "WeakValueDictionary[int, asyncio.Lock]" = WeakValueDictionary()
+event_loop_monitor: Optional[asyncio.Task] = None
 
 class ContextItem(TypedDict):
     question: str
@@ -56,90 +131,178 @@ class ContextItem(TypedDict):
     reference: str
     relevance: float
     is_generated: bool
+    # Эмбеддинг вопроса фрагмента, для отбора разнообразного контекста
+    embedding: Optional[Sequence[float]]
 
 class GeneratedResponse(TypedDict):
     answer: str
     reference: str
 
-def get_embedding(text: str) -> Optional[List[float]]:
+JSON_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+def partial_json_string(buffer: str, field: str) -> Optional[str]:
+    # Достает значение строкового поля из еще не дописанного JSON
+    match = re.search(r'"' + field + r'"\s*:\s*"', buffer)
+    if not match:
+        return None
+    chars = []
+    i = match.end()
+    while i < len(buffer):
+        char = buffer[i]
+        if char == '"':
+            break
+        if char == '\\':
+            if i + 1 >= len(buffer):
+                break
+            escaped = buffer[i + 1]
+            if escaped == 'u':
+                if i + 6 > len(buffer):
+                    break
+                chars.append(chr(int(buffer[i + 2:i + 6], 16)))
+                i += 6
+                continue
+            chars.append(JSON_ESCAPES.get(escaped, escaped))
+            i += 2
+            continue
+        chars.append(char)
+        i += 1
+    return "".join(chars)
+
+def parse_generated(generated: Optional[str]) -> Optional[GeneratedResponse]:
+    if not generated:
+        return None
+    try:
+        data = json.loads(generated)
+    except json.JSONDecodeError as e:
+        logger.error(f"Ошибка разбора ответа модели: {str(e)}")
+        return None
+    if not isinstance(data, dict) or "answer" not in data:
+        return None
+    return {"answer": data["answer"], "reference": data.get("reference", "")}
+
+def normalize_question(text: str) -> str:
+    return normalize_text(text).rstrip(" ?!.")
+
+class ExactMatchIndex:
+    def __init__(self):
+        self.entries: Dict[str, ContextItem] = {}
+
+    def add(self, question: str, answer: str, reference: str, is_generated: bool) -> None:
+        key = normalize_question(question)
+        existing = self.entries.get(key)
+        # Оригинальный ответ из датасета важнее сгенерированного
+        if existing and not existing['is_generated'] and is_generated:
+            return
+        self.entries[key] = {
+            "question": question,
+            "answer": answer,
+            "reference": reference,
+            "relevance": 1.0,
+            "is_generated": is_generated,
+            "embedding": None
+        }
+
+    def lookup(self, query: str) -> Optional[ContextItem]:
+        return self.entries.get(normalize_question(query))
+
+    def load(self, collection, page_size: int = 1000) -> int:
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            for question, metadata in zip(page['documents'], page['metadatas']):
+                self.add(question, metadata["answer"], metadata["reference"], metadata.get('is_generated', False))
+            if len(page['ids']) < page_size:
+                return len(self.entries)
+            offset += page_size
+
+exact_index = ExactMatchIndex()
+
+async def get_embedding(text: str) -> Optional[List[float]]:
+    config = get_config()
     try:
         text = " ".join(text.split())
         
-        if len(text) > config.max_input_tokens * 4:
-            print("Предупреждение: текст слишком длинный, будет использована только его часть")
-            text = text[:config.max_input_tokens * 4]
+        truncated = truncate_tokens(text, config.max_input_tokens, config.embedding_model)
+        if truncated != text:
+            logger.warning("Текст слишком длинный, будет использована только его часть")
+            text = truncated
+
+        cache = get_embedding_cache()
+        cache_model = model_with_dimensions(config.embedding_model, config.embedding_dimensions)
+        with timed("embed_cache", "local", config.embedding_model):
+            cached = await asyncio.to_thread(cache.get, "openai", cache_model, text)
+        if cached is not None:
+            return cached
             
-        response = client_openai.embeddings.create(
-            model=config.embedding_model,
-            input=text
-        )
-        return response.data[0].embedding
+        embedding = await embedding_batcher.submit(text)
+        await asyncio.to_thread(cache.put, "openai", cache_model, text, embedding)
+        return embedding
     except Exception as e:
-        print(f"Ошибка при получении эмбеддинга: {str(e)}")
+        logger.error(f"Ошибка при получении эмбеддинга: {str(e)}")
         return None
 
-def save_generated_answer(question: str, answer: str, reference: str, embedding: Optional[List[float]] = None) -> None:
+async def embed_batch(group, texts: List[str]) -> List[List[float]]:
+    config = get_config()
+    unique, positions = unique_items(texts)
+    # Размерность должна совпадать с той, с которой загружена база (EMBEDDING_DIMENSIONS)
+    options = {"dimensions": config.embedding_dimensions} if config.embedding_dimensions else {}
+    with timed("embed", "openai", config.embedding_model):
+        response = await get_openai_client().embeddings.create(
+            model=config.embedding_model,
+            input=unique,
+            **options
+        )
+    return spread([item.embedding for item in sorted(response.data, key=lambda item: item.index)], positions)
+
+async def search_batch(include_generated: bool, embeddings: List[List[float]]) -> list:
+    return await asyncio.to_thread(get_vector_index().search_many, embeddings, 5, include_generated)
+
+# Одновременные вопросы разных пользователей уходят одним запросом эмбеддингов и одним запросом к базе
+embedding_batcher = MicroBatcher("embed", embed_batch)
+search_batcher = MicroBatcher("retrieve", search_batch)
+
+async def save_generated_answer(question: str, answer: str, reference: str, embedding: Optional[List[float]] = None) -> None:
     try:
         if not embedding:
-            embedding = get_embedding(question)
+            embedding = await get_embedding(question)
         if embedding:
-            collection.add(
-                embeddings=[embedding],
-                documents=[question],
-                metadatas=[{"answer": answer, "reference": reference, "is_generated": True}],
-                ids=[str(collection.count() + 1)]
-            )
+            get_answer_writer().submit(question, answer, reference, embedding)
     except Exception as e:
-        print(f"Ошибка при сохранении ответа: {str(e)}")
+        logger.error(f"Ошибка при сохранении ответа: {str(e)}")
 
-def get_relevant_context(query: str, query_embedding: List[float], include_generated: bool = True) -> List[ContextItem]:
-    print(f"searching... [pre-generated {'included' if include_generated else 'excluded'}]")
+async def get_relevant_context(query: str, query_embedding: List[float], include_generated: bool = True) -> List[ContextItem]:
+    logger.debug("searching", extra=fields(include_generated=include_generated))
     
+    vector_index = get_vector_index()
     try:
-        query_params = {
-            "query_embeddings": [query_embedding],
-            "n_results": 5,
-            "include": ["documents", "metadatas", "distances"]
-        }
-        if not include_generated:
-            query_params["where"] = {"is_generated": False}
-            
-        results = collection.query(**query_params)
+        stage = "retrieve_all" if include_generated else "retrieve_original"
+        with timed(stage, vector_index.provider, get_collection().name):
+            if vector_index.blocking:
+                results = await search_batcher.submit(query_embedding, group=include_generated)
+            else:
+                results = vector_index.search(query_embedding, 5, include_generated)
     except Exception as e:
-        print(f"Ошибка при поиске в базе данных: {str(e)}")
+        logger.error(f"Ошибка при поиске в базе данных: {str(e)}")
         return []
     
     context = []
-    for question, metadata, distance in zip(
-        results['documents'][0],
-        results['metadatas'][0],
-        results['distances'][0]
-    ):
-        relevance = 1 - distance
-        if relevance < config.min_relevance:
-            print(f"relevance: {relevance} | skipped (relevance): {question}")
+    for question, metadata, relevance, embedding in results:
+        if relevance < get_config().min_relevance:
+            logger.debug("candidate skipped", extra=fields(relevance=relevance, question=question))
             continue
             
-        print(f"relevance: {relevance} | added: {question}")
+        logger.debug("candidate added", extra=fields(relevance=relevance, question=question))
         context.append({
             "question": question,
             "answer": metadata["answer"],
             "reference": metadata["reference"],
             "relevance": relevance,
-            "is_generated": metadata.get('is_generated', False)
+            "is_generated": metadata.get('is_generated', False),
+            "embedding": embedding
         })
     return context
 
-def generate_response(query: str, context: List[ContextItem]) -> Optional[str]:
-    if not context:
-        return None
-    
-    context_text = "\n\n".join([
-        f"ФРАГМЕНТ #{i+1}\nВОПРОС:\n{c['question']}\nОТВЕТ:\n{c['answer']}\nURL:\n{c['reference']}"
-        for i, c in enumerate(sorted(context, key=lambda x: x['relevance'], reverse=True))
-    ])
-
-    system_message = '''Ты - медицинская экспертная система. Твоя задача - предоставлять научно точные, хорошо структурированные ответы на основе релевантных фрагментов контекста.
+SYSTEM_MESSAGE = '''Ты - медицинская экспертная система. Твоя задача - предоставлять научно точные, хорошо структурированные ответы на основе релевантных фрагментов контекста.
 
         КРИТИЧЕСКИ ВАЖНЫЕ ПРАВИЛА:
         1. Сравни вопрос пользователя с вопросами во фрагментах
@@ -174,6 +337,10 @@ def generate_response(query: str, context: List[ContextItem]) -> Optional[str]:
         "reference": "URL только тех фрагментов, информация из которых использована в ответе"
         }'''
 
+def format_fragment(number: int, item: ContextItem) -> str:
+    return f"ФРАГМЕНТ #{number}\nВОПРОС:\n{item['question']}\nОТВЕТ:\n{item['answer']}\nURL:\n{item['reference']}"
+
+def build_messages(query: str, context_text: str) -> List[Dict[str, str]]:
     user_message = f'''КОНТЕКСТ:
         {context_text}
 
@@ -192,23 +359,98 @@ def generate_response(query: str, context: List[ContextItem]) -> Optional[str]:
         5. Проверь информативность каждого предложения
 
         Верни JSON с полями "answer" и "reference"'''
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": user_message}
+    ]
+
+def fit_context(query: str, context: List[ContextItem]) -> Optional[Tuple[List[Dict[str, str]], int, List[str], int]]:
+    # Фрагменты добавляются по одному в порядке отбора, пока промпт с запасом на ответ укладывается в TOKEN_BUDGET.
+    # Фрагменты с одним URL объединяются только после этого, иначе длинный объединенный блок
+    # мог бы не поместиться целиком и увести с собой самый релевантный фрагмент
+    config = get_config()
+    model = config.generation_model
+    query = truncate_tokens(query, config.max_input_tokens, model)
+    prompt_limit = config.token_budget - config.min_answer_tokens
+    used_tokens = count_chat_tokens(build_messages(query, ""), model)
+    separator_tokens = count_tokens("\n\n", model)
+    fitted: List[ContextItem] = []
+    for item in context:
+        tokens = count_tokens(format_fragment(len(fitted) + 1, item), model) + (separator_tokens if fitted else 0)
+        if used_tokens + tokens > prompt_limit:
+            continue
+        fitted.append(item)
+        used_tokens += tokens
+    if not fitted:
+        logger.warning("Ни один фрагмент контекста не помещается в TOKEN_BUDGET")
+        return None
+
+    merged_items, merged = merge_by_reference(fitted)
+    fragments = [format_fragment(i + 1, item) for i, item in enumerate(merged_items)]
+    messages = build_messages(query, "\n\n".join(fragments))
+    prompt_tokens = count_chat_tokens(messages, model)
+    max_tokens = min(config.max_answer_tokens, config.token_budget - prompt_tokens)
+    logger.debug("context fitted", extra=fields(fragments=len(fragments), dropped=len(context) - len(fitted),
+                                                merged=merged, prompt_tokens=prompt_tokens, max_tokens=max_tokens))
+    return messages, max_tokens, fragments, merged
+
+def report_context_savings(context: List[ContextItem], fragments: List[str], stats: dict) -> None:
+    # Сравнение с тем, что ушло бы в промпт без отбора: все найденные фрагменты подряд
+    model = get_config().generation_model
+    full_text = "\n\n".join(format_fragment(i + 1, item) for i, item in
+                             enumerate(sorted(context, key=lambda x: x['relevance'], reverse=True)))
+    saved = count_tokens(full_text, model) - count_tokens("\n\n".join(fragments), model)
+    CONTEXT_TOKENS_SAVED.labels(model).inc(max(0, saved))
+    logger.info("context selected", extra=fields(retrieved=len(context), sent=len(fragments),
+                                                 duplicates=stats["duplicates"], merged=stats["merged"],
+                                                 tokens_saved=saved))
+
+async def generate_response(query: str, context: List[ContextItem],
+                            on_partial_answer: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+    if not context:
+        return None
+    
+    config = get_config()
+    selected, stats = select_context(context)
+    fitted = fit_context(query, selected)
+    if not fitted:
+        return None
+    messages, max_tokens, fragments, stats["merged"] = fitted
+    report_context_savings(context, fragments, stats)
     
+    request = {
+        "model": config.generation_model,
+        "messages": messages,
+        "temperature": config.temperature,
+        "max_tokens": max_tokens,
+        "response_format": {"type": "json_object"}
+    }
+
     try:
-        response = client_openai.chat.completions.create(
-            model=config.generation_model,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=config.temperature,
-            max_tokens=1000,
-            response_format={"type": "json_object"}
-        )
-        
-        return response.choices[0].message.content
+        with timed("generate_queue", "local", config.generation_model):
+            await get_generation_semaphore().acquire()
+        try:
+            with timed("generate", "openai", config.generation_model):
+                if on_partial_answer is None:
+                    response = await get_openai_client().chat.completions.create(**request)
+                    return response.choices[0].message.content
+
+                # Потоковый режим: показываем поле answer по мере генерации
+                content = ""
+                stream = await get_openai_client().chat.completions.create(**request, stream=True)
+                async for chunk in stream:
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    content += chunk.choices[0].delta.content
+                    partial_answer = partial_json_string(content, "answer")
+                    if partial_answer:
+                        await on_partial_answer(partial_answer)
+                return content
+        finally:
+            get_generation_semaphore().release()
     
     except Exception as e:
-        print(f"Ошибка при генерации ответа: {str(e)}")
+        logger.error(f"Ошибка при генерации ответа: {str(e)}")
         return None
 
 def format_references(reference: str) -> str:
@@ -216,77 +458,199 @@ def format_references(reference: str) -> str:
         return ""
     return f"\n\nИсточники:\n{'\n'.join(reference.split())}"
 
+def format_direct_answer(item: ContextItem) -> str:
+    emoji = "🚀" if item['is_generated'] else "📖"
+    return f"{emoji} {item['answer']}{format_references(item['reference'])}"
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(
         "Здравствуйте! Я - медицинская экспертная система в области биотехнологий и науки о старении. "
         "Задавайте ваши вопросы, и я постараюсь ответить на них, основываясь на научных данных."
     )
 
+def get_chat_lock(chat_id: int) -> asyncio.Lock:
+    lock = chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        chat_locks[chat_id] = lock
+    return lock
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Обновления обрабатываются параллельно, но порядок внутри одного чата сохраняется
+    # Id попадает во все записи лога этого сообщения, включая ожидание очереди чата
+    new_request_id()
+    async with get_chat_lock(update.effective_chat.id):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            outcome = await answer_message(update, context)
+        finally:
+            seconds = time.perf_counter() - started
+            record_outcome(outcome, "openai", get_config().generation_model, seconds)
+            logger.info("answered", extra=fields(outcome=outcome, seconds=round(seconds, 3)))
+
+async def answer_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    config = get_config()
     query = update.message.text
     user = update.effective_user
     
-    print(f"\n{'='*20} вопрос: {'='*20}")
-    print(f"Username: {user.username or user.id} | Name: {user.first_name}")
-    print(f"Question: {query}")
-    print(f"{'='*60}")
+    logger.info("question", extra=fields(user=user.username or user.id, name=user.first_name, question=query))
     
-    await update.message.chat.send_action(action="typing")
+    # Вопрос уже есть в базе дословно - отвечаем без эмбеддинга и поиска
+    exact_match = exact_index.lookup(query)
+    if exact_match:
+        await reply_long(update.message, format_direct_answer(exact_match))
+        return "exact"
+
+    with timed("telegram_send", "telegram"):
+        await update.message.chat.send_action(action="typing")
     
     # Получаем эмбеддинг один раз
-    query_embedding = get_embedding(query)
+    query_embedding = await get_embedding(query)
     if not query_embedding:
-        await update.message.reply_text("Извините, произошла ошибка при обработке вопроса.")
-        return
+        await reply_long(update.message, "Извините, произошла ошибка при обработке вопроса.")
+        return "error"
     
     # Ищем среди всех ответов
-    relevant_context = get_relevant_context(query, query_embedding=query_embedding, include_generated=True)
+    relevant_context = await get_relevant_context(query, query_embedding=query_embedding, include_generated=True)
     
     # Если контекст пустой, значит вопрос не по теме
     if not relevant_context:
-        await update.message.reply_text("Извините, в базе знаний нет релевантной информации по вашему вопросу.")
-        return
+        await reply_long(update.message, "Извините, в базе знаний нет релевантной информации по вашему вопросу.")
+        return "no_context"
     
     # Если есть ответ с высокой релевантностью - возвращаем его
     if relevant_context[0]['relevance'] >= config.direct_answer_relevance:
-        most_relevant = relevant_context[0]
-        emoji = "🚀" if most_relevant['is_generated'] else "📖"
-        response = f"{emoji} {most_relevant['answer']}{format_references(most_relevant['reference'])}"
+        response = format_direct_answer(relevant_context[0])
+        outcome = "direct"
         
     # Если нет ответа с высокой релевантностью - генерируем новый
     else:
-        original_context = get_relevant_context(query, query_embedding=query_embedding, include_generated=False)
+        original_context = await get_relevant_context(query, query_embedding=query_embedding, include_generated=False)
         if not original_context:
-            await update.message.reply_text("Извините, в базе знаний нет достаточно релевантной информации по вашему вопросу.")
-            return
+            await reply_long(update.message, "Извините, в базе знаний нет достаточно релевантной информации по вашему вопросу.")
+            return "no_context"
             
-        generated = generate_response(query, original_context)
-        if not generated:
-            await update.message.reply_text("Извините, произошла ошибка при генерации ответа.")
-            return
+        reply = None
+        on_partial_answer = None
+        if config.stream_responses:
+            reply = StreamingReply(update.message)
+            await reply.start()
+            on_partial_answer = lambda partial_answer: reply.update(f"🧠 {partial_answer}")
+            
+        response_data = parse_generated(await generate_response(query, original_context, on_partial_answer))
+        if not response_data:
+            error_message = "Извините, произошла ошибка при генерации ответа."
+            if reply:
+                await reply.finish(error_message)
+            else:
+                await reply_long(update.message, error_message)
+            return "error"
             
-        response_data = json.loads(generated)
-        save_generated_answer(
+        await save_generated_answer(
             question=query, 
             answer=response_data["answer"], 
             reference=response_data["reference"],
             embedding=query_embedding
         )
         response = f"🧠 {response_data['answer']}{format_references(response_data['reference'])}"
+        outcome = "generated"
+        if reply:
+            await reply.finish(response)
+            return outcome
     
-    await update.message.reply_text(response)
+    await reply_long(update.message, response)
+    return outcome
+
+async def warm_up_embedding() -> None:
+    config = get_config()
+    options = {"dimensions": config.embedding_dimensions} if config.embedding_dimensions else {}
+    response = await get_openai_client().embeddings.create(model=config.embedding_model, input="прогрев", **options)
+    # Сравниваем с базой настоящую размерность модели (при EMBEDDING_DIMENSIONS=0 - полную),
+    # иначе бот запустится, а каждый поиск упадет в Chroma
+    dimension = len(response.data[0].embedding)
+    stored_dimensions = await asyncio.to_thread(collection_dimension, get_collection())
+    if stored_dimensions and dimension != stored_dimensions:
+        raise StartupError(f"Модель {config.embedding_model} возвращает векторы размерности {dimension}, "
+                           f"а в базе - {stored_dimensions}. Задайте EMBEDDING_DIMENSIONS={stored_dimensions} "
+                           f"(модели text-embedding-3-*) или загрузите базу заново этой моделью")
+
+async def warm_up_bot() -> None:
+    # Индекс в памяти и соединение с OpenAI готовы до первого сообщения
+    steps = [
+        ("ChromaDB", lambda: asyncio.to_thread(warm_collection, get_collection())),
+        ("OpenAI embeddings", warm_up_embedding)
+    ]
+    vector_index = get_vector_index()
+    if vector_index.provider != "chroma":
+        probe = [1.0] + [0.0] * (vector_index.dimension - 1)
+        steps.append((vector_index.provider, lambda: asyncio.to_thread(vector_index.search, probe, 1)))
+    await warm_up(steps, report=logger.info, warn=logger.warning)
+
+async def post_init(application: Application) -> None:
+    global event_loop_monitor
+    await warm_up_bot()
+    event_loop_monitor = asyncio.create_task(monitor_event_loop())
+
+async def shutdown(application: Application) -> None:
+    if event_loop_monitor:
+        event_loop_monitor.cancel()
+    # Дописываем в базу все ответы, которые еще стоят в очереди
+    await asyncio.to_thread(get_answer_writer().stop)
+    stats = await asyncio.to_thread(get_embedding_cache().stats)
+    logger.info(f"Кэш эмбеддингов: попаданий {stats['hits']} (в памяти {stats['memory_hits']}, на диске {stats['disk_hits']}), "
+                f"промахов {stats['misses']}, записей в памяти {stats['memory_entries']}, на диске {stats['disk_entries']}")
 
 def main() -> None:
-    if not os.path.exists("./chroma_db"):
-        print("База данных не найдена. Сначала запустите load_dataset.py")
+    setup_logging()
+    try:
+        config = get_config()
+    except ValueError as e:
+        logger.error(str(e))
+        return
+    if not database_exists():
+        logger.error("База данных не найдена. Сначала запустите load_dataset.py")
         return
 
-    application = Application.builder().token(config.telegram_token).build()
+    try:
+        collection = get_collection()
+    except Exception as e:
+        logger.error(f"Не удалось открыть базу данных: {str(e)}")
+        return
+    try:
+        get_vector_index()
+    except ValueError as e:
+        logger.error(str(e))
+        return
+
+    stored_dimensions = collection_dimension(collection)
+    if config.embedding_dimensions and stored_dimensions and stored_dimensions != config.embedding_dimensions:
+        logger.error(f"В базе векторы размерности {stored_dimensions}, а EMBEDDING_DIMENSIONS={config.embedding_dimensions}. "
+                     f"Выполните python manage_db.py --migrate-dimensions {config.embedding_dimensions} или исправьте .env")
+        return
+
+    logger.info(f"Индекс точных совпадений: {exact_index.load(collection)} вопросов")
+    # Словари токенизатора загружаются один раз при старте, а не в обработчике первого сообщения.
+    # Без них бот работает, но бюджет токенов считается по оценке (см. предупреждение выше)
+    if not preload_encodings([config.embedding_model, config.generation_model]):
+        logger.warning("Словари tiktoken недоступны: бюджет промпта считается приблизительно, с запасом")
+    get_answer_writer().start()
+    if start_metrics_server():
+        export_embedding_cache(get_embedding_cache().stats)
+        logger.info("Метрики доступны на /metrics")
+
+    application = (
+        Application.builder()
+        .token(config.telegram_token)
+        .concurrent_updates(config.concurrent_updates)
+        .post_init(post_init)
+        .post_shutdown(shutdown)
+        .build()
+    )
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    print("Бот запущен")
-    application.run_polling()
+    run_bot(application, report=logger.info, error=logger.error)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
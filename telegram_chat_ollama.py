@@ -1,10 +1,15 @@
 import os
-import chromadb
+import json
+import asyncio
 from dotenv import load_dotenv
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable, Awaitable
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-import requests
+from embedding_cache import get_embedding_cache
+from http_client import aclose as close_http_client, get_async_client, get_session
+from telegram_stream import STREAM_RESPONSES, StreamingReply, reply_long
+from bot_runtime import get_collection, run_bot, warm_collection, warm_up
+from vector_store import database_exists
 
 load_dotenv()
 
@@ -14,31 +19,32 @@ MAX_TOKENS = int(os.getenv('MAX_TOKENS', 8000))
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'evilfreelancer/enbeddrus')
 GENERATION_MODEL = os.getenv('GENERATION_MODEL', 'llama3.2')
+OLLAMA_URL = os.getenv('OLLAMA_URL', 'http://localhost:11434')
 
-if not TELEGRAM_TOKEN:
-    print("Error: TELEGRAM_TOKEN not found in environment variables")
-    exit(1)
-
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_collection("questions")
-
-def get_embedding(text: str) -> Optional[List[float]]:
+async def get_embedding(text: str) -> Optional[List[float]]:
     try:
         text = " ".join(text.split())
         
         if len(text) > MAX_TOKENS * 4:  
             print("Предупреждение: текст слишком длинный, будет обрезан")
             text = text[:MAX_TOKENS * 4]
+
+        cache = get_embedding_cache()
+        cached = await asyncio.to_thread(cache.get, "ollama", EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
         
-        response = requests.post(
-            'http://localhost:11434/api/embeddings',
+        response = await get_async_client().post(
+            f'{OLLAMA_URL}/api/embeddings',
             json={
                 'model': EMBEDDING_MODEL,
                 'prompt': text
             }
         )
         if response.status_code == 200:
-            return response.json()['embedding']
+            embedding = response.json()['embedding']
+            await asyncio.to_thread(cache.put, "ollama", EMBEDDING_MODEL, text, embedding)
+            return embedding
         else:
             print(f"Ошибка получения эмбеддинга: {response.status_code}")
             return None
@@ -46,13 +52,14 @@ def get_embedding(text: str) -> Optional[List[float]]:
         print(f"Ошибка запроса к Ollama: {str(e)}")
         return None
 
-def get_relevant_context(query: str) -> List[Dict]:
-    query_embedding = get_embedding(query)
+async def get_relevant_context(query: str) -> List[Dict]:
+    query_embedding = await get_embedding(query)
     if not query_embedding:
         return []
         
     try:
-        results = collection.query(
+        results = await asyncio.to_thread(
+            get_collection().query,
             query_embeddings=[query_embedding],
             n_results=5,
             include=["documents", "metadatas", "distances"]
@@ -80,7 +87,8 @@ def get_relevant_context(query: str) -> List[Dict]:
         })
     return context
 
-def generate_response(query: str, context: List[Dict]) -> str:
+async def generate_response(query: str, context: List[Dict],
+                            on_partial_answer: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
     if not context:
         return "Извините, в моей базе знаний нет достаточно релевантной информации для ответа на ваш вопрос. Пожалуйста, попробуйте переформулировать вопрос."
     
@@ -129,16 +137,28 @@ def generate_response(query: str, context: List[Dict]) -> str:
         3. Никакой лишней информации
         4. Если данных нет или их недостаточно - так и напиши в одном параграфе'''
 
+    request = {
+        'model': GENERATION_MODEL,
+        'prompt': prompt,
+        'temperature': TEMPERATURE,
+        'stream': on_partial_answer is not None
+    }
+
     try:
-        response = requests.post(
-            'http://localhost:11434/api/generate',
-            json={
-                'model': GENERATION_MODEL,
-                'prompt': prompt,
-                'temperature': TEMPERATURE,
-                'stream': False
-            }
-        )
+        if on_partial_answer is not None:
+            async with get_async_client().stream('POST', f'{OLLAMA_URL}/api/generate', json=request) as response:
+                if response.status_code != 200:
+                    print(f"Ошибка генерации ответа: {response.status_code}")
+                    return "Произошла ошибка при генерации ответа. Пожалуйста, попробуйте еще раз."
+                text = ""
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    text += json.loads(line).get('response', '')
+                    await on_partial_answer(text)
+                return text
+
+        response = await get_async_client().post(f'{OLLAMA_URL}/api/generate', json=request)
         if response.status_code == 200:
             return response.json()['response']
         else:
@@ -170,38 +190,61 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     await update.message.chat.send_action(action="typing")
     
-    relevant_context = get_relevant_context(query)
-    response = generate_response(query, relevant_context)
-    
-    if len(response) > 4096:
-        for i in range(0, len(response), 4096):
-            await update.message.reply_text(response[i:i+4096])
-    else:
-        await update.message.reply_text(response)
+    relevant_context = await get_relevant_context(query)
+    if STREAM_RESPONSES and relevant_context:
+        reply = StreamingReply(update.message)
+        await reply.start()
+        response = await generate_response(query, relevant_context, reply.update)
+        await reply.finish(response)
+        return
+
+    response = await generate_response(query, relevant_context)
+    await reply_long(update.message, response)
+
+async def ollama_post(path: str, body: dict) -> None:
+    response = await get_async_client().post(f'{OLLAMA_URL}{path}', json=body)
+    response.raise_for_status()
+
+async def post_init(application: Application) -> None:
+    # Ollama загружает модели в память при первом обращении - делаем это до первого сообщения.
+    # Пустой prompt в /api/generate только загружает модель, без генерации
+    await warm_up([
+        ("ChromaDB", lambda: asyncio.to_thread(warm_collection, get_collection())),
+        (f"Ollama {EMBEDDING_MODEL}", lambda: ollama_post('/api/embeddings', {'model': EMBEDDING_MODEL, 'prompt': "прогрев"})),
+        (f"Ollama {GENERATION_MODEL}", lambda: ollama_post('/api/generate', {'model': GENERATION_MODEL, 'prompt': ""}))
+    ])
 
 def main() -> None:
-    if not os.path.exists("./chroma_db"):
+    if not TELEGRAM_TOKEN:
+        print("Error: TELEGRAM_TOKEN not found in environment variables")
+        exit(1)
+    if not database_exists():
         print("Error: Database not found. Run load_dataset.py first")
         return
 
     try:
-        response = requests.get('http://localhost:11434/api/tags')
+        response = get_session().get(f'{OLLAMA_URL}/api/tags')
         if response.status_code != 200:
             print("Error: Ollama server is not available")
             exit(1)
     except Exception as e:
         print(f"Error connecting to Ollama: {str(e)}")
-        print("Make sure Ollama is running and available at localhost:11434")
+        print(f"Make sure Ollama is running and available at {OLLAMA_URL}")
         exit(1)
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(lambda _: close_http_client())
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    print("Bot is running")
-    application.run_polling()
+    run_bot(application, "Bot is running")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,54 +1,45 @@
 import os
-import chromadb
-import requests
+import asyncio
 from dotenv import load_dotenv
 from typing import Optional, Dict
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from embedding_cache import get_embedding_cache
+from yandex_client import FOLDER_ID, IAM_TOKEN, OAUTH_TOKEN, get_yandex_client
+from http_client import aclose as close_http_client
+from bot_runtime import get_collection, run_bot, warm_collection, warm_up
+from vector_store import database_exists
 
 load_dotenv()
 
-FOLDER_ID = os.getenv('FOLDER_ID')
-IAM_TOKEN = os.getenv('YC_IAM_TOKEN')
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
 
-if not all([FOLDER_ID, IAM_TOKEN, TELEGRAM_TOKEN]):
-    print("Ошибка: проверьте наличие всех необходимых токенов в .env файле")
-    exit(1)
-
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_collection("questions")
-
-def get_embedding(text: str) -> Optional[list]:
+async def get_embedding(text: str) -> Optional[list]:
     try:
-        request_body = {
-            "modelUri": f"emb://{FOLDER_ID}/text-search-query",
-            "text": text
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {IAM_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding",
-            headers=headers,
-            json=request_body
-        )
-        return response.json()['embedding'] if response.status_code == 200 else None
+        client = get_yandex_client()
+        model_uri = client.embedding_model_uri()
+        cache = get_embedding_cache()
+        cached = await asyncio.to_thread(cache.get, "yandex", model_uri, text)
+        if cached is not None:
+            return cached
+
+        embedding = await client.aembed(text)
+        if embedding:
+            await asyncio.to_thread(cache.put, "yandex", model_uri, text, embedding)
+        return embedding
             
     except Exception as e:
         print(f"Ошибка API: {str(e)}")
         return None
 
-def get_most_relevant_answer(query: str) -> Optional[Dict]:
-    query_embedding = get_embedding(query)
+async def get_most_relevant_answer(query: str) -> Optional[Dict]:
+    query_embedding = await get_embedding(query)
     if not query_embedding:
         return None
         
     try:
-        results = collection.query(
+        results = await asyncio.to_thread(
+            get_collection().query,
             query_embeddings=[query_embedding],
             n_results=1,
             include=["documents", "metadatas", "distances"]
@@ -88,7 +79,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     await update.message.chat.send_action(action="typing")
     
-    answer = get_most_relevant_answer(query)
+    answer = await get_most_relevant_answer(query)
     if answer:
         await update.message.reply_text(
             f"💡 Наиболее релевантный ответ из базы знаний "
@@ -101,17 +92,32 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "❌ В базе знаний не найдено достаточно релевантных ответов на ваш вопрос."
         )
 
+async def post_init(application: Application) -> None:
+    # Индекс в памяти, IAM-токен и соединение с Yandex Cloud готовы до первого сообщения
+    await warm_up([
+        ("ChromaDB", lambda: asyncio.to_thread(warm_collection, get_collection())),
+        ("Yandex embeddings", lambda: get_yandex_client().aembed("прогрев"))
+    ])
+
 def main() -> None:
-    if not os.path.exists("./chroma_db"):
+    if not all([FOLDER_ID, IAM_TOKEN or OAUTH_TOKEN, TELEGRAM_TOKEN]):
+        print("Ошибка: проверьте наличие всех необходимых токенов в .env файле")
+        exit(1)
+    if not database_exists():
         print("База данных не найдена. Сначала запустите load_dataset.py")
         return
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(lambda _: close_http_client())
+        .build()
+    )
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    print("Бот запущен")
-    application.run_polling()
+    run_bot(application)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,25 +1,20 @@
 import os
-import chromadb
-import requests
+import asyncio
 from dotenv import load_dotenv
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable, Awaitable
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from embedding_cache import get_embedding_cache
+from yandex_client import FOLDER_ID, IAM_TOKEN, OAUTH_TOKEN, get_yandex_client
+from http_client import aclose as close_http_client
+from telegram_stream import STREAM_RESPONSES, StreamingReply, reply_long
+from bot_runtime import get_collection, run_bot, warm_collection, warm_up
+from vector_store import database_exists
 
 load_dotenv()
 
-FOLDER_ID = os.getenv('FOLDER_ID')
-IAM_TOKEN = os.getenv('YC_IAM_TOKEN')
 GENERATION_MODEL = os.getenv('GENERATION_MODEL', 'yandexgpt')
 
-if not FOLDER_ID:
-    print("Не найден FOLDER_ID в переменных окружения")
-    exit(1)
-    
-if not IAM_TOKEN:
-    print("Не найден YC_IAM_TOKEN в переменных окружения")
-    exit(1)
-
 class BotConfig:
     def __init__(self):
         self.temperature = float(os.getenv('TEMPERATURE', 0.3))
@@ -27,55 +22,39 @@ class BotConfig:
         self.max_tokens = int(os.getenv('MAX_TOKENS', 8000))
 
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-if not TELEGRAM_TOKEN:
-    print("Не найден токен TELEGRAM_TOKEN в переменных окружения")
-    exit(1)
-
-chroma_client = chromadb.PersistentClient(path="./chroma_db")
-collection = chroma_client.get_collection("questions")
 
-def get_embedding(text: str, config: BotConfig) -> Optional[List[float]]:
+async def get_embedding(text: str, config: BotConfig) -> Optional[List[float]]:
     try:
         text = " ".join(text.split())
         
         if len(text) > config.max_tokens * 4:
             print("Предупреждение: текст слишком длинный, будет использована только его часть")
             text = text[:config.max_tokens * 4]
+
+        client = get_yandex_client()
+        model_uri = client.embedding_model_uri()
+        cache = get_embedding_cache()
+        cached = await asyncio.to_thread(cache.get, "yandex", model_uri, text)
+        if cached is not None:
+            return cached
         
-        request_body = {
-            "modelUri": f"emb://{FOLDER_ID}/text-search-query",
-            "text": text
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {IAM_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/textEmbedding",
-            headers=headers,
-            json=request_body
-        )
-        
-        if response.status_code == 200:
-            return response.json()['embedding']
-        else:
-            print(f"Ошибка при получении эмбеддинга: {response.status_code}")
-            print(f"Ответ: {response.text}")
-            return None
+        embedding = await client.aembed(text)
+        if embedding:
+            await asyncio.to_thread(cache.put, "yandex", model_uri, text, embedding)
+        return embedding
             
     except Exception as e:
         print(f"Ошибка API Yandex: {str(e)}")
         return None
 
-def get_relevant_context(query: str, config: BotConfig) -> List[Dict]:
-    query_embedding = get_embedding(query, config)
+async def get_relevant_context(query: str, config: BotConfig) -> List[Dict]:
+    query_embedding = await get_embedding(query, config)
     if not query_embedding:
         return []
         
     try:
-        results = collection.query(
+        results = await asyncio.to_thread(
+            get_collection().query,
             query_embeddings=[query_embedding],
             n_results=5,
             include=["documents", "metadatas", "distances"]
@@ -103,7 +82,8 @@ def get_relevant_context(query: str, config: BotConfig) -> List[Dict]:
         })
     return context
 
-def generate_response(query: str, context: List[Dict], config: BotConfig) -> str:
+async def generate_response(query: str, context: List[Dict], config: BotConfig,
+                            on_partial_answer: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
     if not context:
         return "Извините, в базе знаний нет достаточно релевантной информации..."
     
@@ -170,41 +150,28 @@ def generate_response(query: str, context: List[Dict], config: BotConfig) -> str
 
     #print(context_text)
     
-    try:
-        request_body = {
-            "modelUri": f"gpt://{FOLDER_ID}/{GENERATION_MODEL}",
-            "completionOptions": {
-                "stream": False,
-                "temperature": config.temperature,
-                "maxTokens": "2000"
-            },
-            "messages": [
-                {"role": "system", "text": system_message},
-                {"role": "user", "text": user_message}
-            ]
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {IAM_TOKEN}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            "https://llm.api.cloud.yandex.net/foundationModels/v1/completion",
-            headers=headers,
-            json=request_body
-        )
-        
-        if response.status_code == 200:
-            return response.json()['result']['alternatives'][0]['message']['text']
-        else:
-            print(f"Ошибка при генерации ответа: {response.status_code}")
-            print(f"Ответ: {response.text}")
-            return "Извините, произошла техническая ошибка. Пожалуйста, попробуйте переформулировать вопрос."
-    
-    except Exception as e:
-        print(f"Ошибка при генерации ответа: {str(e)}")
+    request = {
+        "messages": [
+            {"role": "system", "text": system_message},
+            {"role": "user", "text": user_message}
+        ],
+        "model": GENERATION_MODEL,
+        "temperature": config.temperature,
+        "max_tokens": 2000
+    }
+    if on_partial_answer is None:
+        response = await get_yandex_client().acomplete(**request)
+    else:
+        response = None
+        try:
+            async for response in get_yandex_client().acomplete_stream(**request):
+                await on_partial_answer(response)
+        except Exception as e:
+            print(f"Ошибка при генерации ответа: {str(e)}")
+            response = None
+    if response is None:
         return "Извините, произошла техническая ошибка. Пожалуйста, попробуйте переформулировать вопрос."
+    return response
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(
@@ -244,7 +211,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     await update.message.chat.send_action(action="typing")
     
-    relevant_context = get_relevant_context(query, bot_config)
+    relevant_context = await get_relevant_context(query, bot_config)
 
     '''    
     if relevant_context and relevant_context[0]['relevance'] > 0.7:
@@ -261,13 +228,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
     '''
     await update.message.chat.send_action(action="typing")
-    response = generate_response(query, relevant_context, bot_config)
-    
-    if len(response) > 4096:
-        for i in range(0, len(response), 4096):
-            await update.message.reply_text(response[i:i+4096])
-    else:
-        await update.message.reply_text(response)
+    if STREAM_RESPONSES and relevant_context:
+        reply = StreamingReply(update.message)
+        await reply.start()
+        response = await generate_response(query, relevant_context, bot_config, reply.update)
+        await reply.finish(response)
+        return
+
+    response = await generate_response(query, relevant_context, bot_config)
+    await reply_long(update.message, response)
 
 async def set_temperature(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     bot_config = context.bot_data.get('config')
@@ -304,12 +273,34 @@ async def set_temperature(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             f"Текущее значение: {bot_config.temperature}"
         )
 
+async def post_init(application: Application) -> None:
+    # Индекс в памяти, IAM-токен и соединение с Yandex Cloud готовы до первого сообщения
+    await warm_up([
+        ("ChromaDB", lambda: asyncio.to_thread(warm_collection, get_collection())),
+        ("Yandex embeddings", lambda: get_yandex_client().aembed("прогрев"))
+    ])
+
 def main() -> None:
-    if not os.path.exists("./chroma_db"):
+    if not FOLDER_ID:
+        print("Не найден FOLDER_ID в переменных окружения")
+        exit(1)
+    if not IAM_TOKEN and not OAUTH_TOKEN:
+        print("Не найден YC_OAUTH_TOKEN или YC_IAM_TOKEN в переменных окружения")
+        exit(1)
+    if not TELEGRAM_TOKEN:
+        print("Не найден токен TELEGRAM_TOKEN в переменных окружения")
+        exit(1)
+    if not database_exists():
         print("База данных не найдена. Сначала запустите load_dataset.py")
         return
 
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(lambda _: close_http_client())
+        .build()
+    )
     
     application.bot_data['config'] = BotConfig()
 
@@ -318,8 +309,7 @@ def main() -> None:
     application.add_handler(CommandHandler("temperature", set_temperature))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-    print("Бот запущен")
-    application.run_polling()
+    run_bot(application)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
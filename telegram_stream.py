@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+import logging
+from typing import List, Optional
+from dotenv import load_dotenv
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from metrics import timed
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() in ('1', 'true', 'yes')
+# Telegram ограничивает частоту редактирования сообщений в одном чате (~1 в секунду)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))
+MESSAGE_LIMIT = 4096
+PLACEHOLDER = "⏳"
+FINAL_EDIT_ATTEMPTS = 3
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    return [text[i:i + limit] for i in range(0, len(text), limit)] or [text]
+
+def retry_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+async def reply_long(message: Message, text: str) -> None:
+    for part in split_message(text):
+        with timed("telegram_send", "telegram"):
+            await message.reply_text(part)
+
+class StreamingReply:
+    def __init__(self, message: Message, edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.sent: Optional[Message] = None
+        self.shown = ""
+        self.next_edit_at = 0.0
+
+    async def start(self, placeholder: str = PLACEHOLDER) -> None:
+        with timed("telegram_send", "telegram"):
+            self.sent = await self.message.reply_text(placeholder)
+        self.shown = placeholder
+        self.next_edit_at = time.monotonic() + self.edit_interval
+
+    async def edit(self, text: str) -> None:
+        try:
+            with timed("telegram_edit", "telegram"):
+                await self.sent.edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        self.shown = text
+
+    async def update(self, text: str) -> None:
+        text = text[:MESSAGE_LIMIT]
+        if self.sent is None or not text.strip() or text == self.shown or time.monotonic() < self.next_edit_at:
+            return
+        self.next_edit_at = time.monotonic() + self.edit_interval
+        try:
+            await self.edit(text)
+        except RetryAfter as e:
+            self.next_edit_at = time.monotonic() + retry_seconds(e)
+        except TelegramError as e:
+            # Промежуточное обновление не критично - финальный текст все равно будет отправлен
+            logger.warning(f"Ошибка при обновлении сообщения: {str(e)}")
+
+    async def finish(self, text: str) -> None:
+        parts = split_message(text)
+        if self.sent is None:
+            await reply_long(self.message, text)
+            return
+
+        for attempt in range(FINAL_EDIT_ATTEMPTS):
+            try:
+                if parts[0] != self.shown:
+                    await self.edit(parts[0])
+                break
+            except RetryAfter as e:
+                await asyncio.sleep(retry_seconds(e))
+            except TelegramError as e:
+                logger.warning(f"Ошибка при обновлении сообщения: {str(e)}")
+                break
+        if parts[0] != self.shown:
+            # Отредактировать не удалось - отправляем ответ новым сообщением
+            with timed("telegram_send", "telegram"):
+                await self.message.reply_text(parts[0])
+
+        for part in parts[1:]:
+            with timed("telegram_send", "telegram"):
+                await self.message.reply_text(part)
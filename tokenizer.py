@@ -0,0 +1,60 @@
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Служебные токены формата chat: на каждое сообщение и на начало ответа модели
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+FALLBACK_ENCODING = "cl100k_base"
+# Оценка без словаря, с запасом: в русском тексте токен короче, чем в английском
+CHARS_PER_TOKEN = 2
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> Optional[tiktoken.Encoding]:
+    # Словари tiktoken скачиваются при первом обращении. Неудача тоже кэшируется,
+    # чтобы без сети загрузка не повторялась на каждом сообщении (None - считаем по оценке)
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(FALLBACK_ENCODING)
+    except Exception as e:
+        error = e
+    try:
+        encoding = tiktoken.get_encoding(FALLBACK_ENCODING)
+        logger.warning(f"Не удалось загрузить словарь tiktoken для {model} ({str(error)}), используется {FALLBACK_ENCODING}")
+        return encoding
+    except Exception:
+        logger.warning(f"Не удалось загрузить словарь tiktoken для {model} ({str(error)}): токены считаются приблизительно, "
+                       f"{CHARS_PER_TOKEN} символа на токен. Скачайте словари на машине с доступом к сети "
+                       f"и укажите их каталог в TIKTOKEN_CACHE_DIR")
+        return None
+
+def preload_encodings(models: Iterable[str]) -> bool:
+    # Загрузка при старте, а не в обработчике первого сообщения; False - где-то используется оценка
+    return all([get_encoding(model) is not None for model in models])
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text))
+
+def count_chat_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    return sum(
+        TOKENS_PER_MESSAGE + count_tokens(message["role"], model) + count_tokens(message["content"], model)
+        for message in messages
+    ) + TOKENS_PER_REPLY
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from kb_sync import iter_pages
+
+load_dotenv()
+
+# chroma - поиск через collection.query, numpy - полный перебор по матрице эмбеддингов в памяти
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', 'chroma').lower()
+NUMPY_INDEX_PATH = os.getenv('NUMPY_INDEX_PATH', './numpy_index')
+# Формат матрицы, которая держится в памяти: float32, float16 (вдвое меньше) или int8 с масштабом на вектор (вчетверо меньше)
+NUMPY_INDEX_DTYPE = os.getenv('NUMPY_INDEX_DTYPE', 'float32').lower()
+# Во сколько раз больше кандидатов, чем нужно, пересчитывается по точным float32-векторам
+NUMPY_RESCORE_FACTOR = int(os.getenv('NUMPY_RESCORE_FACTOR', '4'))
+QUANTIZED_DTYPES = ("float16", "int8")
+# Квантованная матрица переводится во float32 блоками, чтобы не создавать полную копию
+SCORE_BLOCK_ROWS = 1024
+
+EMBEDDINGS_FILE = "embeddings.npy"
+RECORDS_FILE = "records.json"
+# Сгенерированные ответы, добавленные после экспорта: эмбеддинги float32 подряд и строки с метаданными
+APPENDED_EMBEDDINGS_FILE = "appended.f32"
+APPENDED_RECORDS_FILE = "appended.jsonl"
+UPDATES_FILE = "updates.jsonl"
+SCALES_FILE = "scales.int8.npy"
+
+def quantized_file(dtype: str) -> str:
+    return f"embeddings.{dtype}.npy"
+
+# (вопрос, метаданные, релевантность, эмбеддинг вопроса)
+SearchResult = Tuple[str, dict, float, np.ndarray]
+
+class ChromaIndex:
+    provider = "chroma"
+    # Запрос к Chroma блокирующий, его выполняют в отдельном потоке
+    blocking = True
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def search(self, embedding: List[float], n_results: int, include_generated: bool = True) -> List[SearchResult]:
+        return self.search_many([embedding], n_results, include_generated)[0]
+
+    def search_many(self, embeddings: List[List[float]], n_results: int,
+                    include_generated: bool = True) -> List[List[SearchResult]]:
+        # Один запрос к Chroma на несколько векторов
+        query_params = {
+            "query_embeddings": embeddings,
+            "n_results": n_results,
+            "include": ["documents", "metadatas", "distances", "embeddings"]
+        }
+        if not include_generated:
+            query_params["where"] = {"is_generated": False}
+        results = self.collection.query(**query_params)
+        return [
+            [(question, metadata, 1 - distance, np.asarray(embedding, dtype=np.float32))
+             for question, metadata, distance, embedding in zip(questions, metadatas, distances, embeddings)]
+            for questions, metadatas, distances, embeddings
+            in zip(results['documents'], results['metadatas'], results['distances'], results['embeddings'])
+        ]
+
+    # Сгенерированные ответы и так пишутся в коллекцию
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[dict]) -> None:
+        pass
+
+    def update(self, ids: List[str], metadatas: List[dict]) -> None:
+        pass
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+def quantize(matrix: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1
+    return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+class NumpyIndex:
+    provider = "numpy"
+    # Перебор нескольких тысяч векторов занимает доли миллисекунды - поток не нужен
+    blocking = False
+
+    def __init__(self, path: str, embeddings: np.ndarray, records: List[dict], quantized: Optional[np.ndarray] = None,
+                 scales: Optional[np.ndarray] = None, rescore_factor: int = NUMPY_RESCORE_FACTOR):
+        self.path = path
+        # Точные векторы остаются на диске (mmap); при квантовании в памяти только quantized и scales
+        self.embeddings = embeddings
+        self.quantized = quantized
+        self.scales = scales
+        self.rescore_factor = rescore_factor
+        # Перевод float16 во float32 заметно медленнее: такой поиск выполняется в отдельном потоке
+        self.blocking = quantized is not None and quantized.dtype == np.float16
+        self.records = records
+        self.dimension = embeddings.shape[1]
+        self.positions: Dict[str, int] = {record["id"]: i for i, record in enumerate(records)}
+        self.active = np.ones(len(records), dtype=bool)
+        self.is_generated = np.array([bool(record["metadata"].get("is_generated", False)) for record in records], dtype=bool)
+        self.appended: List[np.ndarray] = []
+        self.appended_matrix = np.zeros((0, self.dimension), dtype=np.float32)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = NUMPY_INDEX_PATH, dtype: str = NUMPY_INDEX_DTYPE,
+             rescore_factor: int = NUMPY_RESCORE_FACTOR) -> 'NumpyIndex':
+        embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+        if not os.path.exists(embeddings_path):
+            raise ValueError(f"Индекс {path} не найден. Создайте его: python manage_db.py --export-numpy")
+        if dtype != "float32" and dtype not in QUANTIZED_DTYPES:
+            raise ValueError(f"Неизвестный NUMPY_INDEX_DTYPE: {dtype} (ожидается float32, float16 или int8)")
+        # Матрица не читается целиком: страницы подгружаются с диска по мере обращения
+        embeddings = np.load(embeddings_path, mmap_mode='r')
+        quantized = scales = None
+        if dtype in QUANTIZED_DTYPES:
+            quantized = np.load(os.path.join(path, quantized_file(dtype)))
+            if dtype == "int8":
+                scales = np.load(os.path.join(path, SCALES_FILE))
+        with open(os.path.join(path, RECORDS_FILE), encoding='utf-8') as f:
+            records = json.load(f)
+        index = cls(path, embeddings, records, quantized, scales, rescore_factor)
+        index.load_appended()
+        index.load_updates()
+        return index
+
+    def load_appended(self) -> None:
+        records_path = os.path.join(self.path, APPENDED_RECORDS_FILE)
+        if not os.path.exists(records_path):
+            return
+        with open(records_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        vectors = np.fromfile(os.path.join(self.path, APPENDED_EMBEDDINGS_FILE), dtype=np.float32)
+        vectors = vectors[:len(vectors) // self.dimension * self.dimension].reshape(-1, self.dimension)
+        # После сбоя между двумя записями учитываем только полные пары
+        for record, vector in zip(records, vectors):
+            self.add(record, vector)
+        self.appended_matrix = np.vstack(self.appended) if self.appended else self.appended_matrix
+
+    def load_updates(self) -> None:
+        updates_path = os.path.join(self.path, UPDATES_FILE)
+        if not os.path.exists(updates_path):
+            return
+        with open(updates_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    update = json.loads(line)
+                    self.merge_metadata(update["id"], update["metadata"])
+
+    def add(self, record: dict, vector: np.ndarray) -> None:
+        position = self.positions.get(record["id"])
+        if position is not None:
+            self.active[position] = False
+        self.positions[record["id"]] = len(self.records)
+        self.records.append(record)
+        self.active = np.append(self.active, True)
+        self.is_generated = np.append(self.is_generated, bool(record["metadata"].get("is_generated", False)))
+        self.appended.append(vector)
+
+    def coarse_scores(self, query: np.ndarray) -> np.ndarray:
+        if self.quantized is None:
+            return self.embeddings @ query
+        scores = np.empty(len(self.quantized), dtype=np.float32)
+        for start in range(0, len(self.quantized), SCORE_BLOCK_ROWS):
+            block = self.quantized[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, embedding: List[float], n_results: int, include_generated: bool = True) -> List[SearchResult]:
+        query = np.asarray(embedding, dtype=np.float32)
+        # Новый массив: вектор вызывающего кода (например, recall_report) не должен меняться
+        query = query / (np.linalg.norm(query) or 1)
+        with self.lock:
+            scores = np.concatenate([self.coarse_scores(query), self.appended_matrix @ query])
+            allowed = self.active if include_generated else self.active & ~self.is_generated
+            scores[~allowed] = -np.inf
+            n_allowed = int(allowed.sum())
+            n_results = min(n_results, n_allowed)
+            if not n_results:
+                return []
+            candidates = n_results if self.quantized is None else min(n_allowed, n_results * self.rescore_factor)
+            top = np.argpartition(-scores, candidates - 1)[:candidates]
+            if self.quantized is not None:
+                # Приближенные оценки только отбирают кандидатов, итоговая релевантность - по точным векторам
+                rescored = np.sort(top[top < len(self.embeddings)])
+                scores[rescored] = self.embeddings[rescored] @ query
+            top = top[np.argsort(-scores[top])][:n_results]
+            return [(self.records[i]["document"], self.records[i]["metadata"], float(scores[i]), self.vector(i)) for i in top]
+
+    def vector(self, position: int) -> np.ndarray:
+        if position < len(self.embeddings):
+            return np.asarray(self.embeddings[position], dtype=np.float32)
+        return self.appended_matrix[position - len(self.embeddings)]
+
+    def search_many(self, embeddings: List[List[float]], n_results: int,
+                    include_generated: bool = True) -> List[List[SearchResult]]:
+        return [self.search(embedding, n_results, include_generated) for embedding in embeddings]
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]], documents: List[str], metadatas: List[dict]) -> None:
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        records = [{"id": entry_id, "document": document, "metadata": metadata}
+                   for entry_id, document, metadata in zip(ids, documents, metadatas)]
+        # Сначала векторы, потом метаданные: при загрузке неполная пара отбрасывается
+        with open(os.path.join(self.path, APPENDED_EMBEDDINGS_FILE), 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(os.path.join(self.path, APPENDED_RECORDS_FILE), 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self.lock:
+            for record, vector in zip(records, vectors):
+                self.add(record, vector)
+            self.appended_matrix = np.vstack(self.appended)
+
+    def merge_metadata(self, entry_id: str, metadata: dict) -> None:
+        position = self.positions.get(entry_id)
+        if position is not None:
+            self.records[position]["metadata"] = {**self.records[position]["metadata"], **metadata}
+
+    def update(self, ids: List[str], metadatas: List[dict]) -> None:
+        with open(os.path.join(self.path, UPDATES_FILE), 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps({"id": entry_id, "metadata": metadata}, ensure_ascii=False) + "\n"
+                         for entry_id, metadata in zip(ids, metadatas))
+        with self.lock:
+            for entry_id, metadata in zip(ids, metadatas):
+                self.merge_metadata(entry_id, metadata)
+
+def export_numpy_index(collection, path: str = NUMPY_INDEX_PATH) -> int:
+    embeddings = []
+    records = []
+    for page in iter_pages(collection, include=["embeddings", "documents", "metadatas"]):
+        embeddings.append(np.asarray(page['embeddings'], dtype=np.float32))
+        records.extend({"id": entry_id, "document": document, "metadata": metadata or {}}
+                       for entry_id, document, metadata in zip(page['ids'], page['documents'], page['metadatas']))
+    if not records:
+        raise ValueError("Коллекция пуста, экспортировать нечего")
+
+    os.makedirs(path, exist_ok=True)
+    matrix = normalize_rows(np.vstack(embeddings))
+    arrays = {EMBEDDINGS_FILE: matrix}
+    for dtype in QUANTIZED_DTYPES:
+        quantized, scales = quantize(matrix, dtype)
+        arrays[quantized_file(dtype)] = quantized
+        if scales is not None:
+            arrays[SCALES_FILE] = scales
+
+    # Пишем во временные файлы и подменяем, чтобы не оставить наполовину записанный индекс
+    for name, array in arrays.items():
+        with open(os.path.join(path, name + ".tmp"), 'wb') as f:
+            np.save(f, array)
+    with open(os.path.join(path, RECORDS_FILE + ".tmp"), 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False)
+    for name in [*arrays, RECORDS_FILE]:
+        os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+    # Все добавленные ранее ответы уже есть в коллекции, а значит и в новом экспорте
+    for name in (APPENDED_EMBEDDINGS_FILE, APPENDED_RECORDS_FILE, UPDATES_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    return len(records)
+
+def recall_report(path: str = NUMPY_INDEX_PATH, queries: int = 200, k: int = 5,
+                  noise: float = 0.3, seed: int = 0) -> List[dict]:
+    # Запросы - зашумленные векторы самой базы; эталон - точный поиск по float32
+    baseline = NumpyIndex.load(path, "float32")
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(baseline.embeddings), size=min(queries, len(baseline.embeddings)), replace=False)
+    vectors = np.asarray(baseline.embeddings[np.sort(rows)], dtype=np.float32)
+    vectors = normalize_rows(vectors + rng.normal(0, noise / np.sqrt(baseline.dimension), vectors.shape).astype(np.float32))
+    expected = [{document for document, *_ in baseline.search(vector, k)} for vector in vectors]
+
+    report = []
+    for dtype, rescore_factor in [("float32", 1)] + [(dtype, factor) for dtype in QUANTIZED_DTYPES
+                                                      for factor in (1, NUMPY_RESCORE_FACTOR)]:
+        index = NumpyIndex.load(path, dtype, rescore_factor)
+        started = time.perf_counter()
+        found = [{document for document, *_ in index.search(vector, k)} for vector in vectors]
+        elapsed = time.perf_counter() - started
+        resident = index.embeddings if index.quantized is None else index.quantized
+        report.append({
+            "dtype": dtype,
+            "rescore_factor": rescore_factor if index.quantized is not None else 0,
+            "recall": float(np.mean([len(e & f) / len(e) for e, f in zip(expected, found)])),
+            "resident_bytes": int(resident.nbytes + (index.scales.nbytes if index.scales is not None else 0)),
+            "search_ms": elapsed / len(vectors) * 1000
+        })
+    return report
+
+def open_vector_index(collection, backend: str = RETRIEVAL_BACKEND, path: str = NUMPY_INDEX_PATH):
+    if backend == "numpy":
+        return NumpyIndex.load(path)
+    if backend == "chroma":
+        return ChromaIndex(collection)
+    raise ValueError(f"Неизвестный RETRIEVAL_BACKEND: {backend} (ожидается chroma или numpy)")
@@ -0,0 +1,26 @@
+import os
+import chromadb
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# embedded - база открывается внутри процесса из CHROMA_PATH (для разработки, один процесс);
+# http - отдельный сервер Chroma (chroma run --path ./chroma_db), общий для всех ботов, загрузчиков и manage_db.py
+CHROMA_MODE = os.getenv('CHROMA_MODE', 'embedded').lower()
+CHROMA_PATH = os.getenv('CHROMA_PATH', './chroma_db')
+CHROMA_HOST = os.getenv('CHROMA_HOST', 'localhost')
+CHROMA_PORT = int(os.getenv('CHROMA_PORT', '8000'))
+
+def is_embedded() -> bool:
+    return CHROMA_MODE != "http"
+
+def get_chroma_client():
+    if CHROMA_MODE == "http":
+        return chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+    if CHROMA_MODE != "embedded":
+        raise ValueError(f"Неизвестный CHROMA_MODE={CHROMA_MODE}, допустимо embedded или http")
+    return chromadb.PersistentClient(path=CHROMA_PATH)
+
+def database_exists() -> bool:
+    # У сервера каталога базы рядом может не быть: коллекция проверяется при первом обращении
+    return not is_embedded() or os.path.exists(CHROMA_PATH)
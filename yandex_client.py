@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+import httpx
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional
+from dotenv import load_dotenv
+from http_client import get_async_client, get_session
+
+load_dotenv()
+
+FOLDER_ID = os.getenv('FOLDER_ID')
+IAM_TOKEN = os.getenv('YC_IAM_TOKEN')
+OAUTH_TOKEN = os.getenv('YC_OAUTH_TOKEN')
+# Квоты каталога на запросы в секунду (по умолчанию - стандартные квоты Foundation Models)
+EMBEDDING_RPS = float(os.getenv('YC_EMBEDDING_RPS', '10'))
+COMPLETION_RPS = float(os.getenv('YC_COMPLETION_RPS', '10'))
+REQUEST_TIMEOUT = float(os.getenv('YC_REQUEST_TIMEOUT', '60'))
+MAX_RETRIES = int(os.getenv('YC_MAX_RETRIES', '5'))
+# IAM-токен живет до 12 часов, обновляем заранее
+IAM_REFRESH_INTERVAL = int(os.getenv('YC_IAM_REFRESH_INTERVAL', '3600'))
+
+# Базовые адреса можно переопределить (например, на локальную заглушку из fake_providers.py)
+LLM_API_URL = os.getenv('YC_LLM_API_URL', 'https://llm.api.cloud.yandex.net').rstrip('/')
+IAM_API_URL = os.getenv('YC_IAM_API_URL', 'https://iam.api.cloud.yandex.net').rstrip('/')
+
+EMBEDDING_URL = f"{LLM_API_URL}/foundationModels/v1/textEmbedding"
+COMPLETION_URL = f"{LLM_API_URL}/foundationModels/v1/completion"
+IAM_URL = f"{IAM_API_URL}/iam/v1/tokens"
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class YandexAPIError(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        while (wait := self.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+class IamTokenProvider:
+    def __init__(self, oauth_token: Optional[str] = OAUTH_TOKEN, static_token: Optional[str] = IAM_TOKEN,
+                 refresh_interval: int = IAM_REFRESH_INTERVAL):
+        self.oauth_token = oauth_token
+        self.token = static_token
+        self.refresh_interval = refresh_interval
+        self.refreshed_at: Optional[float] = None
+        self.lock = threading.Lock()
+        self.refresher: Optional[threading.Thread] = None
+
+    def refresh(self) -> str:
+        response = get_session().post(IAM_URL, json={"yandexPassportOauthToken": self.oauth_token}, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise YandexAPIError(f"Не удалось получить IAM-токен: {response.status_code} {response.text}")
+        with self.lock:
+            self.token = response.json()['iamToken']
+            self.refreshed_at = time.monotonic()
+            return self.token
+
+    def refresh_loop(self) -> None:
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Ошибка обновления IAM-токена: {str(e)}")
+
+    def get(self) -> str:
+        # Без OAuth-токена работаем со статическим YC_IAM_TOKEN, как раньше
+        if self.oauth_token:
+            with self.lock:
+                if self.refresher is None:
+                    self.refresher = threading.Thread(target=self.refresh_loop, daemon=True)
+                    self.refresher.start()
+                stale = self.refreshed_at is None or time.monotonic() - self.refreshed_at > self.refresh_interval * 2
+            # Фоновое обновление не справилось (или еще не запускалось) - обновляем синхронно
+            if stale:
+                return self.refresh()
+        if not self.token:
+            raise YandexAPIError("Не найден YC_OAUTH_TOKEN или YC_IAM_TOKEN в переменных окружения")
+        return self.token
+
+class YandexClient:
+    def __init__(self, folder_id: Optional[str] = FOLDER_ID, tokens: Optional[IamTokenProvider] = None,
+                 embedding_rps: float = EMBEDDING_RPS, completion_rps: float = COMPLETION_RPS):
+        self.folder_id = folder_id
+        self.tokens = tokens or IamTokenProvider()
+        self.embedding_bucket = TokenBucket(embedding_rps)
+        self.completion_bucket = TokenBucket(completion_rps)
+        # Одновременно держим не больше запросов, чем позволяет квота
+        self.embedding_concurrency = max(1, int(embedding_rps))
+
+    def embedding_model_uri(self, model: str = "text-search-query") -> str:
+        return f"emb://{self.folder_id}/{model}"
+
+    def completion_model_uri(self, model: str) -> str:
+        return f"gpt://{self.folder_id}/{model}"
+
+    def headers(self, token: str) -> dict:
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+    def post(self, url: str, body: dict, bucket: TokenBucket) -> dict:
+        token_refreshed = False
+        for attempt in range(MAX_RETRIES + 1):
+            bucket.acquire()
+            try:
+                response = get_session().post(url, headers=self.headers(self.tokens.get()), json=body, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                if attempt == MAX_RETRIES:
+                    raise YandexAPIError(str(e))
+                time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 401 and not token_refreshed and self.tokens.oauth_token:
+                self.tokens.refresh()
+                token_refreshed = True
+                continue
+            if response.status_code not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                raise YandexAPIError(f"{response.status_code} {response.text}")
+            # Полный джиттер, чтобы параллельные запросы не повторялись синхронно
+            time.sleep(random.uniform(0, min(30, 2 ** attempt)))
+        raise YandexAPIError("Превышено число попыток")
+
+    async def asend(self, url: str, body: dict, bucket: TokenBucket, stream: bool = False) -> httpx.Response:
+        # При stream=True возвращается открытый ответ со статусом 200, вызывающий код закрывает его сам
+        client = get_async_client()
+        token_refreshed = False
+        for attempt in range(MAX_RETRIES + 1):
+            await bucket.acquire_async()
+            # Получение токена может потребовать синхронного запроса к IAM
+            token = await asyncio.to_thread(self.tokens.get)
+            request = client.build_request("POST", url, headers=self.headers(token), json=body, timeout=REQUEST_TIMEOUT)
+            try:
+                response = await client.send(request, stream=stream)
+            except httpx.HTTPError as e:
+                if attempt == MAX_RETRIES:
+                    raise YandexAPIError(str(e))
+                await asyncio.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+                continue
+
+            if response.status_code == 200:
+                return response
+            if stream:
+                await response.aread()
+                await response.aclose()
+            if response.status_code == 401 and not token_refreshed and self.tokens.oauth_token:
+                await asyncio.to_thread(self.tokens.refresh)
+                token_refreshed = True
+                continue
+            if response.status_code not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                raise YandexAPIError(f"{response.status_code} {response.text}")
+            await asyncio.sleep(random.uniform(0, min(30, 2 ** attempt)))
+        raise YandexAPIError("Превышено число попыток")
+
+    async def apost(self, url: str, body: dict, bucket: TokenBucket) -> dict:
+        return (await self.asend(url, body, bucket)).json()
+
+    def embedding_body(self, text: str, model: str) -> dict:
+        return {"modelUri": self.embedding_model_uri(model), "text": text}
+
+    def completion_body(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> dict:
+        return {
+            "modelUri": self.completion_model_uri(model),
+            "completionOptions": {
+                "stream": False,
+                "temperature": temperature,
+                "maxTokens": str(max_tokens)
+            },
+            "messages": messages
+        }
+
+    def embed(self, text: str, model: str = "text-search-query") -> Optional[List[float]]:
+        try:
+            result = self.post(EMBEDDING_URL, self.embedding_body(text, model), self.embedding_bucket)
+            return result['embedding']
+        except Exception as e:
+            print(f"Ошибка API Yandex при получении эмбеддинга: {str(e)}")
+            return None
+
+    async def aembed(self, text: str, model: str = "text-search-query") -> Optional[List[float]]:
+        try:
+            result = await self.apost(EMBEDDING_URL, self.embedding_body(text, model), self.embedding_bucket)
+            return result['embedding']
+        except Exception as e:
+            print(f"Ошибка API Yandex при получении эмбеддинга: {str(e)}")
+            return None
+
+    def embed_many(self, texts: List[str], model: str = "text-search-query") -> List[Optional[List[float]]]:
+        with ThreadPoolExecutor(max_workers=self.embedding_concurrency) as executor:
+            return list(executor.map(lambda text: self.embed(text, model), texts))
+
+    def complete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> Optional[str]:
+        try:
+            result = self.post(
+                COMPLETION_URL,
+                self.completion_body(messages, model, temperature, max_tokens),
+                self.completion_bucket
+            )
+            return result['result']['alternatives'][0]['message']['text']
+        except Exception as e:
+            print(f"Ошибка API Yandex при генерации ответа: {str(e)}")
+            return None
+
+    async def acomplete_stream(self, messages: List[Dict[str, str]], model: str, temperature: float,
+                               max_tokens: int) -> AsyncIterator[str]:
+        # Каждая строка потока содержит весь сгенерированный к этому моменту текст
+        body = self.completion_body(messages, model, temperature, max_tokens)
+        body["completionOptions"]["stream"] = True
+        # Повторяется только установка соединения: после начала потока часть ответа уже показана пользователю
+        response = await self.asend(COMPLETION_URL, body, self.completion_bucket, stream=True)
+        try:
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)['result']['alternatives'][0]['message']['text']
+        finally:
+            await response.aclose()
+
+    async def acomplete(self, messages: List[Dict[str, str]], model: str, temperature: float, max_tokens: int) -> Optional[str]:
+        try:
+            result = await self.apost(
+                COMPLETION_URL,
+                self.completion_body(messages, model, temperature, max_tokens),
+                self.completion_bucket
+            )
+            return result['result']['alternatives'][0]['message']['text']
+        except Exception as e:
+            print(f"Ошибка API Yandex при генерации ответа: {str(e)}")
+            return None
+
+_client: Optional[YandexClient] = None
+_client_lock = threading.Lock()
+
+def get_yandex_client() -> YandexClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = YandexClient()
+        return _client